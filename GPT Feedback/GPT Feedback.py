@@ -2,14 +2,29 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, Dict, Any, Optional
 import os
+import io
+import sys
 import json
+import shutil
 import re
 import time
 import logging
+import logging.handlers
 import hashlib
+import random
+import threading
+import queue
+import tracemalloc
+import sqlite3
+import socket
+import ssl
 import requests
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
 from datetime import datetime
-from html import escape
+from html import escape, unescape
+from urllib.parse import urlparse
 
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from telebot.apihelper import ApiTelegramException
@@ -30,6 +45,10 @@ SETTINGS_PAGE = True
 logger = logging.getLogger(f"FPC.{__name__}")
 PREFIX = f"[{NAME}]"
 
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_WINDOW = 60.0
+LOG_SAMPLE_BURST = 5
+
 INSTRUCTION_URL = "https://teletype.in/@tinechelovec/GPT-Feedback"
 
 IO_BASE_URL = os.getenv("IOINTELLIGENCE_BASE_URL", "https://api.intelligence.io.solutions/api/v1/")
@@ -47,6 +66,42 @@ DEFAULT_MODEL = IO_MODEL
 PLUGIN_FOLDER = "storage/plugins/gpt_feedback"
 DATA_FILE = os.path.join(PLUGIN_FOLDER, "data.json")
 STATE_FILE = os.path.join(PLUGIN_FOLDER, "state.json")
+TRACE_FILE = os.path.join(PLUGIN_FOLDER, "trace.jsonl")
+HISTORY_DB = os.path.join(PLUGIN_FOLDER, "history.db")
+OUTBOX_FILE = os.path.join(PLUGIN_FOLDER, "outbox.json")
+SHADOW_FILE = os.path.join(PLUGIN_FOLDER, "shadow.json")
+SHADOW_API_KEY_ENV = (os.getenv("GPTFEEDBACK_SHADOW_API_KEY", "") or "").strip()
+SHADOW_QUEUE_SIZE = 50
+SHADOW_LATENCY_KEEP = 200
+SHADOW_IDLE_WAIT = 120.0
+
+ACCOUNTS_FOLDER = os.path.join(PLUGIN_FOLDER, "accounts")
+ACCOUNT_ENV = (os.getenv("GPTFEEDBACK_ACCOUNT", "") or "").strip()
+MIGRATED_MARK = os.path.join(ACCOUNTS_FOLDER, ".migrated")
+
+POOL_ADDRESS = (os.getenv("GPTFEEDBACK_POOL_HOST", "127.0.0.1"), int(os.getenv("GPTFEEDBACK_POOL_PORT", "47821")))
+POOL_AUTHKEY = (os.getenv("GPTFEEDBACK_POOL_KEY", "") or "").strip().encode()
+POOL_ALLOW_REMOTE = (os.getenv("GPTFEEDBACK_POOL_ALLOW_REMOTE", "") or "").strip() == "1"
+POOL_MIN_KEY_LEN = 16
+POOL_MAX_MESSAGE = 1024 * 1024
+POOL_WORKERS = int(os.getenv("GPTFEEDBACK_POOL_WORKERS", "4"))
+POOL_RPM = int(os.getenv("GPTFEEDBACK_POOL_RPM", "60"))
+POOL_WAIT = 300.0
+
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 300
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_DEFAULT_TOP = 25
+PROFILE_IDLE_FRAMES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("socket.py", "accept"), ("connection.py", "_recv"), ("connection.py", "_poll"), ("selectors.py", "select"),
+}
+
+PROBE_N_OPTIONS = (5, 10, 20, 50)
+PROBE_C_OPTIONS = (1, 2, 4, 8)
+PROBE_INFO_BLOCK = "- Имя: Покупатель\n- Товар: 1000 золота\n- Стоимость: 150 рублей\n- Оценка: 5 из 5\n- Отзыв: всё супер, быстро"
+HISTORY_PAGE_SIZE = 5
+TRACE_MAX_BYTES = int(os.getenv("GPTFEEDBACK_TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
 os.makedirs(PLUGIN_FOLDER, exist_ok=True)
 
 if not os.path.exists(DATA_FILE):
@@ -57,22 +112,56 @@ if not os.path.exists(STATE_FILE):
     with open(STATE_FILE, "w", encoding="utf-8") as f:
         json.dump({}, f, indent=4, ensure_ascii=False)
 
+if not os.path.exists(OUTBOX_FILE):
+    with open(OUTBOX_FILE, "w", encoding="utf-8") as f:
+        json.dump({}, f, indent=4, ensure_ascii=False)
+
 ORDER_ID_REGEX = re.compile(r"#([A-Za-z0-9]+)")
 MAX_ATTEMPTS = 3
+RETRY_DELAY = 1.0
 MAX_CHARACTERS = 700
 MIN_CHARACTERS = 30
-
-DEFAULT_PROMPT_TEMPLATE = """
+FALLBACK_REPLY = "Спасибо за отзыв! 😊"
+
+PREGEN_TTL = int(os.getenv("GPTFEEDBACK_PREGEN_TTL", str(6 * 3600)))
+PREGEN_CACHE_SIZE = int(os.getenv("GPTFEEDBACK_PREGEN_CACHE_SIZE", "200"))
+PREGEN_QUEUE_SIZE = 100
+PREGEN_IDLE_WAIT = 300.0
+
+GEN_WORKERS = int(os.getenv("GPTFEEDBACK_GEN_WORKERS", "2"))
+BATCH_MAX = int(os.getenv("GPTFEEDBACK_BATCH_MAX", "5"))
+BATCH_WINDOW = float(os.getenv("GPTFEEDBACK_BATCH_WINDOW_MS", "300")) / 1000.0
+
+OUTBOX_MIN_INTERVAL = float(os.getenv("GPTFEEDBACK_OUTBOX_MIN_INTERVAL", "3"))
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 5.0
+OUTBOX_BACKOFF_MAX = 600.0
+OUTBOX_RATE_LIMIT_COOLDOWN = 60.0
+
+PERF_FIELDS = {
+    "timeout": ("Таймаут запроса, с", float, 5.0, 180.0),
+    "temperature": ("Температура", float, 0.0, 2.0),
+    "max_attempts": ("Попыток на ответ", int, 1, 10),
+    "max_chars": ("Макс. длина ответа", int, 200, 1000),
+    "min_chars": ("Мин. длина ответа", int, 1, 200),
+    "gen_workers": ("Потоков генерации", int, 1, 16),
+    "batch_max": ("Отзывов в пакете", int, 1, 20),
+    "batch_window_ms": ("Окно пакета, мс", int, 0, 5000),
+    "pregen_cache_size": ("Размер кэша черновиков", int, 0, 5000),
+    "pregen_ttl": ("Жизнь черновика, с", int, 60, 7 * 86400),
+    "outbox_interval": ("Пауза между записями FunPay, с", float, 0.5, 60.0),
+    "pool_rpm": ("Лимит общего пула, запр/мин", int, 1, 6000),
+}
+
+SYSTEM_PROMPT = """
 Привет! Ты - ИИ Ассистент в нашем интернет-магазине игровых ценностей.
-
-Информация о покупателе и заказе:
-{info_block}
+Тебе пришлют информацию о покупателе и заказе, а ты ответишь на его отзыв.
 
 Твоя задача:
 - Ответить покупателю в доброжелательном тоне.
 - Использовать много эмодзи.
 - Обязательно учесть информацию о покупателе и заказе.
-- Написать большой и развернутый ответ до 700 симвболо.
+- Написать большой и развернутый ответ до 700 символов.
 - Пожелать что-нибудь хорошее покупателю.
 
 Важно:
@@ -80,10 +169,44 @@ DEFAULT_PROMPT_TEMPLATE = """
 - Не использовать оскорбления, ненормативную лексику, противозаконную или политическую информацию.
 - НЕ ВЫДАВАТЬ ФРАГМЕНТЫ КОДА ИЛИ ЛИСТИНГИ КОДА.
 - НЕ ИСПОЛЬЗОВАТЬ MARKDOWN / HTML / РАЗМЕТКУ.
+- Не писать дату, время и строку благодарности за звёзды — она добавляется автоматически.
+""".strip()
+PROMPT_VERSION = "2"
+PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+PROMPT_ID = f"v{PROMPT_VERSION}:{PROMPT_HASH}"
+
+DEFAULT_PROMPT_TEMPLATE = """
+Информация о покупателе и заказе:
+{info_block}
+""".strip()
+
+BATCH_PROMPT_TEMPLATE = """
+Ниже несколько отзывов. Для КАЖДОГО заказа напиши отдельный ответ по правилам выше.
+
+{items}
 
-В конце добавь строку: Спасибо за {rating} звезд и отзыв от {date} {time}!
+Верни ТОЛЬКО JSON-массив без пояснений, по одному объекту на заказ:
+[{{"order_id": "<номер заказа>", "reply": "<ответ>"}}]
 """.strip()
 
+CLOSING_TEMPLATE = "Спасибо за {rating} звезд и отзыв от {date} {time}!"
+CLOSING_RE = re.compile(
+    r"[ \t]*Спасибо за[ \t]*\d[ \t]*зв[её]зд\w*[ \t]+и отзыв от[ \t]+\d{1,2}\.\d{1,2}\.\d{2,4}[ \t]+\d{1,2}:\d{2}(?::\d{2})?[ \t]*!?",
+    re.IGNORECASE,
+)
+
+MAX_EMOJI_RUN = 3
+_EMOJI = "[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF]\uFE0F?"
+EMOJI_UNIT_RE = re.compile(f"{_EMOJI}(?:\u200D{_EMOJI})*")
+EMOJI_RUN_RE = re.compile(f"{_EMOJI}(?:\u200D{_EMOJI})*(?:\\s*{_EMOJI}(?:\u200D{_EMOJI})*){{{MAX_EMOJI_RUN},}}")
+CODE_FENCE_RE = re.compile(r"```.*?(?:```|$)", re.DOTALL)
+MD_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+HTML_TAG_RE = re.compile(r"</?[A-Za-z][^>]*>")
+URL_RE = re.compile(r"(?:https?://|www\.)\S+|\b[\w.-]+\.(?:ru|com|net|org|io|gg|me|su|info|shop|store)\b(?:/\S*)?", re.IGNORECASE)
+MD_LINE_RE = re.compile(r"^[ \t]*(?:#{1,6}[ \t]+|>[ \t]*|[-*+•][ \t]+|\d+[.)][ \t]+)", re.MULTILINE)
+MD_INLINE_RE = re.compile(r"(\*\*|__|~~|`)(?=\S)(.+?)(?<=\S)\1|(?<![\w*])\*(?=[^\s*])([^*\n]+?)(?<=[^\s*])\*(?![\w*])")
+SENTENCE_END_RE = re.compile(r"[.!?…](?=\s|$)")
+
 try:
     import tg_bot.CBT as CBT
 except Exception:
@@ -101,13 +224,29 @@ CB_DELETE = f"{UUID}:delete"
 CB_DELETE_YES = f"{UUID}:delete_yes"
 CB_DELETE_NO = f"{UUID}:delete_no"
 CB_TOGGLE = f"{UUID}:toggle"
+CB_PREGEN = f"{UUID}:pregen"
+CB_TRACE = f"{UUID}:trace"
+CB_POOL = f"{UUID}:pool"
 CB_STARS = f"{UUID}:stars"
 CB_STAR_TOGGLE = f"{UUID}:star"
 CB_FIELDS = f"{UUID}:fields"
 CB_FIELD_TOGGLE = f"{UUID}:field"
 CB_APIKEY = f"{UUID}:apikey"
 CB_TEST = f"{UUID}:test"
+CB_TEST_ONE = f"{UUID}:test_one"
+CB_PROBE_RUN = f"{UUID}:probe_run"
+CB_PROBE_N = f"{UUID}:probe_n"
+CB_PROBE_C = f"{UUID}:probe_c"
 CB_CANCEL = f"{UUID}:cancel"
+CB_HISTORY = f"{UUID}:hist"
+CB_PERF = f"{UUID}:perf"
+CB_PERF_EDIT = f"{UUID}:perf_edit"
+CB_PERF_RESET = f"{UUID}:perf_reset"
+CB_SHADOW = f"{UUID}:shadow"
+CB_SHADOW_TOGGLE = f"{UUID}:shadow_toggle"
+CB_SHADOW_SAMPLE = f"{UUID}:shadow_sample"
+CB_SHADOW_MODELS = f"{UUID}:shadow_models"
+CB_SHADOW_RESET = f"{UUID}:shadow_reset"
 CBT_PLUGINS_LIST_OPEN = f"{getattr(CBT, 'PLUGINS_LIST', '44')}:0"
 
 _fsm: Dict[int, Dict[str, Any]] = {}
@@ -115,14 +254,110 @@ _fsm: Dict[int, Dict[str, Any]] = {}
 def open_plugins_list(cardinal: "Cardinal", call):
     pass
 
-def logi(msg: str):
-    logger.info(f"{PREFIX} INFO: {msg}")
+class _DropQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+    reported_at = 0.0
+    lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                _DropQueueHandler.dropped += 1
+            return
+        if self.dropped and time.monotonic() - self.reported_at >= LOG_SAMPLE_WINDOW:
+            self._report_dropped()
+
+    def _report_dropped(self):
+        with self.lock:
+            n = _DropQueueHandler.dropped
+            if not n:
+                return
+            note = logger.makeRecord(logger.name, logging.WARNING, __file__, 0,
+                                     f"{PREFIX} WARNING: очередь логов переполнена, потеряно строк: {n}", None, None)
+            try:
+                self.queue.put_nowait(note)
+            except queue.Full:
+                return
+            _DropQueueHandler.dropped -= n
+            _DropQueueHandler.reported_at = time.monotonic()
+
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_listener: Optional[logging.handlers.QueueListener] = None
+_log_samples: Dict[str, list] = {}
+_log_samples_lock = threading.Lock()
+
+def _setup_async_logging():
+    global _log_listener
+    if _log_listener is not None:
+        return
+    handlers = []
+    parent = logger.parent
+    while parent is not None:
+        handlers.extend(h for h in parent.handlers if h not in handlers)
+        if not parent.propagate:
+            break
+        parent = parent.parent
+    if not handlers:
+        return
+    _log_listener = logging.handlers.QueueListener(_log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    logger.addHandler(_DropQueueHandler(_log_queue))
+    logger.propagate = False
+
+def _log_allowed(key: Optional[str]) -> tuple:
+    if not key:
+        return True, 0
+    now = time.monotonic()
+    with _log_samples_lock:
+        slot = _log_samples.get(key)
+        if slot is None or now - slot[0] >= LOG_SAMPLE_WINDOW:
+            suppressed = slot[2] if slot else 0
+            _log_samples[key] = [now, 1, 0]
+            if len(_log_samples) > 1000:
+                for k in [k for k, v in _log_samples.items() if now - v[0] >= LOG_SAMPLE_WINDOW]:
+                    _log_samples.pop(k, None)
+            return True, suppressed
+        if slot[1] < LOG_SAMPLE_BURST:
+            slot[1] += 1
+            return True, 0
+        slot[2] += 1
+        return False, 0
+
+def _log(level: int, label: str, msg: str, key: Optional[str] = None):
+    if not logger.isEnabledFor(level):
+        return
+    ok, suppressed = _log_allowed(key)
+    if not ok:
+        return
+    if suppressed:
+        msg = f"{msg} (+{suppressed} похожих подавлено)"
+    logger.log(level, f"{PREFIX} {label}: {msg}")
+
+def logi(msg: str, key: Optional[str] = None):
+    _log(logging.INFO, "INFO", msg, key)
+
+def logw(msg: str, key: Optional[str] = None):
+    _log(logging.WARNING, "WARNING", msg, key)
+
+def loge(msg: str, key: Optional[str] = None):
+    _log(logging.ERROR, "ERROR", msg, key)
 
-def logw(msg: str):
-    logger.warning(f"{PREFIX} WARNING: {msg}")
+def _kv(v: Any) -> str:
+    if isinstance(v, float):
+        return f"{v:.3f}".rstrip("0").rstrip(".")
+    s = str(v)
+    if not s or any(c.isspace() or c in "=\"" for c in s):
+        return json.dumps(s, ensure_ascii=False)
+    return s
 
-def loge(msg: str):
-    logger.error(f"{PREFIX} ERROR: {msg}")
+def logkv(level: int, event: str, key: Optional[str] = None, **fields):
+    if not logger.isEnabledFor(level):
+        return
+    label = logging.getLevelName(level)
+    msg = " ".join([f"event={event}"] + [f"{k}={_kv(v)}" for k, v in fields.items() if v is not None])
+    _log(level, label, msg, key)
 
 def _load_json(path: str) -> dict:
     try:
@@ -134,8 +369,10 @@ def _load_json(path: str) -> dict:
 
 def _save_json(path: str, data: dict):
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, path)
     except Exception as e:
         loge(f"_save_json({path}) failed: {e}")
 
@@ -151,12 +388,207 @@ def load_state() -> dict:
 def save_state(st: dict):
     _save_json(STATE_FILE, st)
 
+_namespace = ""
+
+def _account_key(cardinal: "Cardinal") -> str:
+    acc = getattr(cardinal, "account", None)
+    raw = ACCOUNT_ENV or str(getattr(acc, "id", None) or getattr(acc, "username", None) or "")
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", raw)[:64]
+
+def _migrate_root(folder: str):
+    first = not os.path.exists(MIGRATED_MARK)
+    for name in ("data.json", "state.json", "outbox.json", "shadow.json", "history.db"):
+        src, dst = os.path.join(PLUGIN_FOLDER, name), os.path.join(folder, name)
+        if not os.path.exists(src) or os.path.exists(dst) or (not first and name != "data.json"):
+            continue
+        try:
+            if name == "history.db":
+                with sqlite3.connect(src, timeout=10) as a, sqlite3.connect(dst) as b:
+                    a.backup(b)
+            else:
+                shutil.copy2(src, dst)
+        except Exception as e:
+            logw(f"migrate {name} -> {folder} failed: {e}")
+    if first:
+        with open(MIGRATED_MARK, "w", encoding="utf-8") as f:
+            f.write(os.path.basename(folder))
+
+def _set_namespace(ns: str):
+    global _namespace, DATA_FILE, STATE_FILE, TRACE_FILE, HISTORY_DB, OUTBOX_FILE, SHADOW_FILE
+    global _outbox, _shadow_stats, _history_ready, _trace_cfg_last, _trace_capped
+    folder = os.path.join(ACCOUNTS_FOLDER, ns)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+        _migrate_root(folder)
+    for name in ("data.json", "state.json", "outbox.json"):
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            _save_json(path, {})
+    with _outbox_lock, _shadow_lock, _history_lock:
+        _namespace = ns
+        DATA_FILE = os.path.join(folder, "data.json")
+        STATE_FILE = os.path.join(folder, "state.json")
+        TRACE_FILE = os.path.join(folder, "trace.jsonl")
+        HISTORY_DB = os.path.join(folder, "history.db")
+        OUTBOX_FILE = os.path.join(folder, "outbox.json")
+        SHADOW_FILE = os.path.join(folder, "shadow.json")
+        _outbox = None
+        _shadow_stats = None
+        _history_ready = False
+        _trace_cfg_last = None
+        _trace_capped = False
+    _outbox_wake.set()
+    logi(f"аккаунт {ns}: данные в {folder}")
+
+def _init_account(cardinal: "Cardinal") -> bool:
+    ns = _account_key(cardinal)
+    if not ns or ns == _namespace:
+        return False
+    _set_namespace(ns)
+    return True
+
+_trace_enabled = False
+_trace_lock = threading.Lock()
+_trace_ctx = threading.local()
+_trace_cfg_last: Optional[dict] = None
+_trace_capped = False
+
+def _set_trace(on: bool, cfg: Optional[dict] = None):
+    global _trace_enabled, _trace_cfg_last
+    _trace_enabled = bool(on) and not _trace_capped
+    if not _trace_enabled:
+        _trace_cfg_last = None
+    elif cfg is not None:
+        _trace_cfg(cfg)
+
+def _trace_cfg(cfg: dict):
+    global _trace_cfg_last
+    snap = _trace_config(cfg)
+    if not _trace_enabled or snap == _trace_cfg_last:
+        return
+    _trace_cfg_last = snap
+    _trace("cfg", cfg=snap)
+
+def _trace(kind: str, **fields):
+    if not _trace_enabled:
+        return
+    rec = {"k": kind, "t": round(time.time(), 3)}
+    oid = getattr(_trace_ctx, "oid", None)
+    if oid and "oid" not in fields:
+        rec["oid"] = oid
+    rec.update(fields)
+    line = json.dumps(rec, ensure_ascii=False, separators=(",", ":"))
+    capped = False
+    with _trace_lock:
+        try:
+            if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) > TRACE_MAX_BYTES:
+                capped = True
+            else:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            loge(f"_trace failed: {e}", key="trace_failed")
+    if capped:
+        _trace_stop_capped()
+
+def _trace_stop_capped():
+    global _trace_capped
+    if _trace_capped:
+        return
+    _trace_capped = True
+    _set_trace(False)
+    logw(f"trace file exceeded {TRACE_MAX_BYTES} bytes, capture stopped", key="trace_capped")
+    try:
+        cfg = _get_config(load_data())
+        cfg["trace"] = False
+        _set_config(cfg)
+    except Exception as e:
+        loge(f"trace cap: saving config failed: {e}", key="trace_capped_cfg")
+
+def _trace_order_fields(order) -> Optional[Dict[str, Any]]:
+    if not order:
+        return None
+    review = getattr(order, "review", None)
+    name = str(getattr(order, "buyer_username", "") or "")
+    return {
+        "buyer": hashlib.sha256(name.encode("utf-8", errors="ignore")).hexdigest()[:10] if name else "",
+        "item": str(getattr(order, "title", "") or ""),
+        "cost": str(getattr(order, "sum", "") or getattr(order, "price", "") or ""),
+        "review": {
+            "stars": getattr(review, "stars", None),
+            "text": str(getattr(review, "text", "") or ""),
+        } if review else None,
+    }
+
+def _trace_config(cfg: dict) -> dict:
+    return {k: v for k, v in cfg.items() if k != "api_key"}
+
+def _perf_defaults() -> dict:
+    return {
+        "timeout": IO_TIMEOUT,
+        "temperature": IO_TEMPERATURE,
+        "max_attempts": MAX_ATTEMPTS,
+        "max_chars": MAX_CHARACTERS,
+        "min_chars": MIN_CHARACTERS,
+        "gen_workers": GEN_WORKERS,
+        "batch_max": BATCH_MAX,
+        "batch_window_ms": int(BATCH_WINDOW * 1000),
+        "pregen_cache_size": PREGEN_CACHE_SIZE,
+        "pregen_ttl": PREGEN_TTL,
+        "outbox_interval": OUTBOX_MIN_INTERVAL,
+        "pool_rpm": POOL_RPM,
+    }
+
+_perf: Dict[str, Any] = _perf_defaults()
+
+def _parse_perf_value(key: str, raw: Any):
+    if key == "model":
+        v = str(raw or "").strip()
+        if not v or len(v) > 120 or any(c.isspace() for c in v):
+            raise ValueError("название модели без пробелов, до 120 символов")
+        return v
+    if key not in PERF_FIELDS:
+        raise ValueError("неизвестный параметр")
+    _, typ, lo, hi = PERF_FIELDS[key]
+    try:
+        v = typ(float(str(raw).replace(",", ".")))
+    except (TypeError, ValueError):
+        raise ValueError("нужно число")
+    if not lo <= v <= hi:
+        raise ValueError(f"допустимо от {lo} до {hi}")
+    return v
+
+def _valid_perf(raw: Any) -> dict:
+    out = _perf_defaults()
+    for k, v in (raw or {}).items() if isinstance(raw, dict) else []:
+        try:
+            out[k] = _parse_perf_value(k, v)
+        except ValueError:
+            continue
+    if out["min_chars"] >= out["max_chars"]:
+        out["min_chars"] = min(MIN_CHARACTERS, out["max_chars"] - 1)
+    return out
+
+def _apply_perf(cfg: dict):
+    _perf.update(_valid_perf(cfg.get("perf")))
+    with _drafts_lock:
+        _drafts_purge(time.time())
+    if _gen_threads:
+        _ensure_gen_workers()
+    _outbox_wake.set()
+
 def _default_config() -> dict:
     return {
         "enabled": False,
+        "pregen": False,
+        "trace": False,
+        "pool": False,
         "stars": [5],
         "api_key": "",
         "model": DEFAULT_MODEL,
+        "perf": _perf_defaults(),
+        "shadow": {"enabled": False, "sample": 0.1, "models": []},
+        "probe": {"n": 10, "concurrency": 4},
         "fields": {
             "name": True,
             "item": True,
@@ -180,6 +612,9 @@ def _get_config(data: dict) -> dict:
         base = _default_config()
         base.update(cfg)
         base["fields"] = {**_default_config()["fields"], **(cfg.get("fields") or {})}
+        base["perf"] = _valid_perf(cfg.get("perf"))
+        base["shadow"] = {**_default_config()["shadow"], **(cfg.get("shadow") or {})}
+        base["probe"] = {**_default_config()["probe"], **(cfg.get("probe") or {})}
         stars = cfg.get("stars")
         if not isinstance(stars, list) or not stars:
             base["stars"] = [5]
@@ -208,6 +643,7 @@ def _set_config(cfg: dict):
     cfg.pop("prompt", None)
     data["global"] = cfg
     save_data(data)
+    _trace_cfg(cfg)
 
 def _safe_edit(bot, chat_id: int, msg_id: int, text: str, kb=None):
     try:
@@ -263,6 +699,7 @@ def _welcome_kb() -> InlineKeyboardMarkup:
         InlineKeyboardButton("📘 Инструкция", url=INSTRUCTION_URL),
     )
     kb.row(
+        InlineKeyboardButton("📜 История", callback_data=CB_HISTORY),
         InlineKeyboardButton("🗑 Удалить плагин", callback_data=CB_DELETE),
     )
     kb.row(
@@ -287,6 +724,13 @@ def open_welcome(cardinal: "Cardinal", call_or_msg):
         chat_id = call_or_msg.chat.id
         bot.send_message(chat_id, _welcome_text(cfg), parse_mode="HTML", reply_markup=_welcome_kb(), disable_web_page_preview=True)
 
+def _pregen_text(cfg: dict) -> str:
+    if not cfg.get("pregen"):
+        return "❌ ВЫКЛ"
+    if not _pregen_useful(cfg):
+        return "⏸ ВКЛ, но не работают: текст отзыва идёт в промпт (выключи поле «Отзыв»)"
+    return "✅ ВКЛ (в простое, без текста отзыва)"
+
 def _settings_text(cfg: dict) -> str:
     stars = cfg.get("stars", [5]) or [5]
     key = _get_api_key(cfg)
@@ -295,6 +739,12 @@ def _settings_text(cfg: dict) -> str:
         "⚙️ <b>Настройки</b>\n\n"
         f"Статус: {'✅ ВКЛ' if cfg.get('enabled') else '❌ ВЫКЛ'}\n"
         f"Звёзды: {', '.join(map(str, stars))}\n"
+        f"Черновики заранее: {_pregen_text(cfg)}\n"
+        f"Запись трассы: {'⏺ ВКЛ' if cfg.get('trace') else '❌ ВЫКЛ'}\n"
+        f"Аккаунт: <code>{escape(_namespace or 'общий')}</code>\n"
+        f"Общий пул: {_pool_text()}\n"
+        f"Промпт: <code>{PROMPT_ID}</code>\n"
+        f"{_usage_text()}"
         f"API ключ: <b>{key_state}</b> (<code>{_mask_key(key)}</code>)\n\n"
         "Настрой параметры ниже:"
     )
@@ -310,8 +760,17 @@ def _settings_kb() -> InlineKeyboardMarkup:
         InlineKeyboardButton("🔑 API ключ", callback_data=CB_APIKEY),
     )
     kb.row(
+        InlineKeyboardButton("🔮 Черновики", callback_data=CB_PREGEN),
+        InlineKeyboardButton("⏺ Трасса", callback_data=CB_TRACE),
+    )
+    kb.row(
+        InlineKeyboardButton("⚡ Производительность", callback_data=CB_PERF),
         InlineKeyboardButton("🧪 Тест API", callback_data=CB_TEST),
     )
+    kb.row(
+        InlineKeyboardButton("🕶 Сравнение моделей", callback_data=CB_SHADOW),
+        InlineKeyboardButton("🤝 Общий пул", callback_data=CB_POOL),
+    )
     kb.row(InlineKeyboardButton("◀️ Назад", callback_data=CB_WELCOME))
     return kb
 
@@ -511,13 +970,19 @@ def _parse_key_text(raw_text: str) -> str:
 def _fsm_cancel(cardinal: "Cardinal", call):
     bot = cardinal.telegram.bot
     chat_id = call.message.chat.id
-    _fsm.pop(chat_id, None)
+    st = _fsm.pop(chat_id, None) or {}
 
     try:
         bot.answer_callback_query(call.id, "Отменено.")
     except Exception:
         pass
 
+    if st.get("return") == "perf":
+        _perf_open(cardinal, call)
+        return
+    if st.get("return") == "shadow":
+        _shadow_open(cardinal, call)
+        return
     open_settings(cardinal, call)
 
 def _handle_fsm(message, cardinal: "Cardinal"):
@@ -554,6 +1019,220 @@ def _handle_fsm(message, cardinal: "Cardinal"):
             _safe_edit(bot, chat_id, panel_msg_id, _settings_text(cfg), _settings_kb())
         return
 
+    if mode == "perf":
+        key = st.get("key")
+        panel_msg_id = st.get("panel_msg_id")
+        try:
+            value = _parse_perf_value(key, text)
+        except ValueError as e:
+            if panel_msg_id:
+                _safe_edit(bot, chat_id, panel_msg_id, _perf_input_text(cfg, key, str(e)), _input_kb(CB_PERF))
+            return
+
+        if key == "model":
+            cfg["model"] = value
+        else:
+            perf = dict(cfg.get("perf") or {})
+            perf[key] = value
+            cfg["perf"] = _valid_perf(perf)
+        _set_config(cfg)
+        _apply_perf(cfg)
+        _fsm.pop(chat_id, None)
+        logkv(logging.INFO, "perf_changed", param=key, value=value)
+
+        if panel_msg_id:
+            _safe_edit(bot, chat_id, panel_msg_id, _perf_text(cfg), _perf_kb())
+        return
+
+    if mode == "shadow_models":
+        specs = [x.strip() for x in re.split(r"[,\n]", text) if x.strip()]
+        specs = [x for x in specs if _parse_shadow_model(x)[0] and len(x) <= 200][:5]
+        sh = dict(cfg.get("shadow") or {})
+        sh["models"] = [] if text in ("-", "—") else specs
+        cfg["shadow"] = sh
+        _set_config(cfg)
+        _fsm.pop(chat_id, None)
+
+        panel_msg_id = st.get("panel_msg_id")
+        if panel_msg_id:
+            _safe_edit(bot, chat_id, panel_msg_id, _shadow_text(cfg), _shadow_kb(cfg))
+        return
+
+PERF_KEYS = ["model"] + list(PERF_FIELDS)
+
+def _perf_value(cfg: dict, key: str) -> Any:
+    if key == "model":
+        return cfg.get("model") or DEFAULT_MODEL
+    return (cfg.get("perf") or {}).get(key, _perf_defaults()[key])
+
+def _perf_title(key: str) -> str:
+    return "Модель" if key == "model" else PERF_FIELDS[key][0]
+
+def _perf_text(cfg: dict) -> str:
+    lines = [f"{_perf_title(k)}: <code>{escape(str(_perf_value(cfg, k)))}</code>" for k in PERF_KEYS]
+    return (
+        "⚡ <b>Производительность</b>\n\n"
+        + "\n".join(lines)
+        + "\n\nИзменения применяются сразу, без перезапуска.\nВыбери параметр:"
+    )
+
+def _perf_kb() -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup()
+    buttons = [InlineKeyboardButton(_perf_title(k), callback_data=f"{CB_PERF_EDIT}:{i}") for i, k in enumerate(PERF_KEYS)]
+    for i in range(0, len(buttons), 2):
+        kb.row(*buttons[i:i + 2])
+    kb.row(InlineKeyboardButton("♻️ По умолчанию", callback_data=CB_PERF_RESET))
+    kb.row(InlineKeyboardButton("◀️ Назад", callback_data=CB_SETTINGS))
+    return kb
+
+def _perf_open(cardinal: "Cardinal", call):
+    bot = cardinal.telegram.bot
+    cfg = _get_config(load_data())
+
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+    _safe_edit(bot, call.message.chat.id, call.message.id, _perf_text(cfg), _perf_kb())
+
+def _perf_input_text(cfg: dict, key: str, error: str = "") -> str:
+    if key == "model":
+        hint = "название модели провайдера"
+    else:
+        _, typ, lo, hi = PERF_FIELDS[key]
+        hint = f"{'целое число' if typ is int else 'число'} от {lo} до {hi}"
+    return (
+        f"⚡ <b>{escape(_perf_title(key))}</b>\n\n"
+        f"Сейчас: <code>{escape(str(_perf_value(cfg, key)))}</code>\n"
+        f"Отправь новое значение одним сообщением ({hint}).\n"
+        + (f"\n❌ {escape(error)}\n" if error else "")
+        + "Чтобы отменить — нажми ❌ Отменить."
+    )
+
+def _perf_edit_start(cardinal: "Cardinal", call, idx: int):
+    bot = cardinal.telegram.bot
+    chat_id = call.message.chat.id
+    msg_id = call.message.id
+    if not 0 <= idx < len(PERF_KEYS):
+        return
+    key = PERF_KEYS[idx]
+    cfg = _get_config(load_data())
+
+    _fsm[chat_id] = {"mode": "perf", "key": key, "panel_chat_id": chat_id, "panel_msg_id": msg_id, "return": "perf"}
+
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+    _safe_edit(bot, chat_id, msg_id, _perf_input_text(cfg, key), _input_kb(CB_PERF))
+
+def _perf_reset(cardinal: "Cardinal", call):
+    bot = cardinal.telegram.bot
+    cfg = _get_config(load_data())
+    cfg["perf"] = _perf_defaults()
+    cfg["model"] = DEFAULT_MODEL
+    _set_config(cfg)
+    _apply_perf(cfg)
+
+    try:
+        bot.answer_callback_query(call.id, "Сброшено.")
+    except Exception:
+        pass
+
+    _safe_edit(bot, call.message.chat.id, call.message.id, _perf_text(cfg), _perf_kb())
+
+SHADOW_SAMPLES = (5, 10, 25, 50, 100)
+
+def _shadow_text(cfg: dict) -> str:
+    sh = cfg.get("shadow") or {}
+    models = sh.get("models") or []
+    return (
+        "🕶 <b>Сравнение моделей (shadow)</b>\n\n"
+        f"Статус: {'✅ ВКЛ' if sh.get('enabled') else '❌ ВЫКЛ'}\n"
+        f"Выборка: <b>{round(float(sh.get('sample') or 0) * 100)}%</b> отзывов\n"
+        f"Текущая модель: <code>{escape(cfg.get('model') or DEFAULT_MODEL)}</code>\n"
+        f"Кандидаты: {', '.join(f'<code>{escape(m)}</code>' for m in models) if models else '—'}\n\n"
+        "Ответы кандидатов не отправляются, запросы идут только когда нет реальной работы.\n"
+        "p50/p95 — задержка, с; in/out — токены; len — символы; ok% — прошли проверку.\n\n"
+        f"<pre>{escape(_shadow_table())}</pre>"
+    )
+
+def _shadow_kb(cfg: dict) -> InlineKeyboardMarkup:
+    sh = cfg.get("shadow") or {}
+    current = round(float(sh.get("sample") or 0) * 100)
+    kb = InlineKeyboardMarkup()
+    kb.row(
+        InlineKeyboardButton("🔛 Вкл/Выкл", callback_data=CB_SHADOW_TOGGLE),
+        InlineKeyboardButton("✏️ Кандидаты", callback_data=CB_SHADOW_MODELS),
+    )
+    kb.row(*[
+        InlineKeyboardButton(f"{'✅' if p == current else ''}{p}%", callback_data=f"{CB_SHADOW_SAMPLE}:{p}")
+        for p in SHADOW_SAMPLES
+    ])
+    kb.row(
+        InlineKeyboardButton("🔄 Обновить", callback_data=CB_SHADOW),
+        InlineKeyboardButton("🧹 Сбросить статистику", callback_data=CB_SHADOW_RESET),
+    )
+    kb.row(InlineKeyboardButton("◀️ Назад", callback_data=CB_SETTINGS))
+    return kb
+
+def _shadow_open(cardinal: "Cardinal", call, note: Optional[str] = None):
+    bot = cardinal.telegram.bot
+    cfg = _get_config(load_data())
+
+    try:
+        bot.answer_callback_query(call.id, note)
+    except Exception:
+        pass
+
+    _safe_edit(bot, call.message.chat.id, call.message.id, _shadow_text(cfg), _shadow_kb(cfg))
+
+def _shadow_toggle(cardinal: "Cardinal", call):
+    cfg = _get_config(load_data())
+    sh = dict(cfg.get("shadow") or {})
+    sh["enabled"] = not bool(sh.get("enabled"))
+    cfg["shadow"] = sh
+    _set_config(cfg)
+    _shadow_open(cardinal, call, f"Shadow {'включён' if sh['enabled'] else 'выключен'}")
+
+def _shadow_set_sample(cardinal: "Cardinal", call, pct: int):
+    cfg = _get_config(load_data())
+    sh = dict(cfg.get("shadow") or {})
+    sh["sample"] = max(0, min(100, pct)) / 100.0
+    cfg["shadow"] = sh
+    _set_config(cfg)
+    _shadow_open(cardinal, call, f"Выборка: {pct}%")
+
+def _shadow_stats_reset(cardinal: "Cardinal", call):
+    _shadow_reset()
+    _shadow_open(cardinal, call, "Статистика сброшена.")
+
+def _shadow_models_start(cardinal: "Cardinal", call):
+    bot = cardinal.telegram.bot
+    chat_id = call.message.chat.id
+    msg_id = call.message.id
+    cfg = _get_config(load_data())
+    models = (cfg.get("shadow") or {}).get("models") or []
+
+    _fsm[chat_id] = {"mode": "shadow_models", "panel_chat_id": chat_id, "panel_msg_id": msg_id, "return": "shadow"}
+
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+    text = (
+        "✏️ <b>Модели-кандидаты</b>\n\n"
+        f"Сейчас: {', '.join(f'<code>{escape(m)}</code>' for m in models) if models else '—'}\n\n"
+        "Отправь до 5 моделей через запятую или с новой строки.\n"
+        "Другой OpenAI-совместимый провайдер: <code>модель@https://host/v1/chat/completions</code> "
+        "(ключ берётся только из env GPTFEEDBACK_SHADOW_API_KEY, без него такие кандидаты пропускаются).\n"
+        "Отправь <code>-</code> чтобы очистить список."
+    )
+    _safe_edit(bot, chat_id, msg_id, text, _input_kb(CB_SHADOW))
+
 class _SafeDict(dict):
     def __missing__(self, key):
         return ""
@@ -572,9 +1251,9 @@ def _extract_order_fields(order) -> Dict[str, str]:
 
     return {"name": name, "item": item, "cost": cost, "rating": rating, "text": text}
 
-def _build_info_block(cfg: dict, order) -> str:
+def _build_info_block(cfg: dict, order, vals: Optional[Dict[str, str]] = None) -> str:
     f = cfg.get("fields") or {}
-    vals = _extract_order_fields(order)
+    vals = vals or _extract_order_fields(order)
 
     lines = []
     if f.get("name"):
@@ -592,11 +1271,13 @@ def _build_info_block(cfg: dict, order) -> str:
         lines = ["- (поля выключены в настройках)"]
     return "\n".join(lines)
 
-def build_prompt(cfg: dict, order) -> str:
+def build_prompt(cfg: dict, order, stars: Optional[int] = None) -> str:
     review = getattr(order, "review", None)
     vals = _extract_order_fields(order)
+    if stars is not None:
+        vals["rating"] = str(stars)
 
-    info_block = _build_info_block(cfg, order)
+    info_block = _build_info_block(cfg, order, vals)
     prompt_tpl = DEFAULT_PROMPT_TEMPLATE
 
     mapping = _SafeDict({
@@ -604,10 +1285,8 @@ def build_prompt(cfg: dict, order) -> str:
         "name": vals.get("name", ""),
         "item": vals.get("item", ""),
         "cost": vals.get("cost", ""),
-        "rating": str(getattr(review, "stars", "") or vals.get("rating", "") or ""),
+        "rating": str(stars or getattr(review, "stars", "") or vals.get("rating", "") or ""),
         "text": str(getattr(review, "text", "") or vals.get("text", "") or ""),
-        "date": datetime.now().strftime("%d.%m.%Y"),
-        "time": datetime.now().strftime("%H:%M:%S"),
     })
 
     try:
@@ -616,54 +1295,346 @@ def build_prompt(cfg: dict, order) -> str:
         loge(f"build_prompt format failed: {e}")
         return prompt_tpl + "\n\n" + info_block
 
-def _cut_700_no_dots(text: str, limit: int = MAX_CHARACTERS) -> str:
+def _cut_700_no_dots(text: str, limit: Optional[int] = None) -> str:
     if text is None:
         return ""
+    limit = limit or _perf["max_chars"]
     t = str(text).strip()
     if len(t) <= limit:
         return t
     cut_point = t.rfind(" ", 0, limit)
     return t[:cut_point] if cut_point != -1 else t[:limit]
 
-def generate_response(prompt: str, api_key: str, model: str) -> str:
-    if not api_key:
-        return "❌ API-ключ не настроен. Открой меню и укажи ключ (или задай env IOINTELLIGENCE_API_KEY / IONET_API_KEY)."
+def _http_post(url: str, headers: dict, payload: dict, timeout: float):
+    batch = getattr(_trace_ctx, "batch", None)
+    shadow = getattr(_trace_ctx, "shadow", None)
+    if shadow:
+        kind, extra = "shadow", {"model": shadow}
+    else:
+        kind, extra = ("llm_batch", {"oids": batch}) if batch else ("llm", {})
+    t0 = time.perf_counter()
+    try:
+        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    except Exception as e:
+        _trace(kind, lat=round(time.perf_counter() - t0, 3), err=type(e).__name__, **extra)
+        raise
+    if _trace_enabled:
+        body: Any = None
+        try:
+            data = resp.json()
+            body = {"choices": data.get("choices"), "usage": data.get("usage")}
+        except Exception:
+            body = (resp.text or "")[:2000]
+        _trace(kind, lat=round(time.perf_counter() - t0, 3), st=resp.status_code, body=body, **extra)
+    return resp
+
+def _collapse_emoji_run(m) -> str:
+    return "".join(u.group(0) for u in list(EMOJI_UNIT_RE.finditer(m.group(0)))[:MAX_EMOJI_RUN])
+
+def _trim_sentences(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    ends = [m.end() for m in SENTENCE_END_RE.finditer(head)]
+    if ends and ends[-1] >= limit // 2:
+        cut = ends[-1]
+        tail = EMOJI_RUN_RE.match(text, cut) or EMOJI_UNIT_RE.match(text, cut)
+        if tail and tail.end() <= limit:
+            cut = tail.end()
+        return text[:cut].rstrip()
+    return _cut_700_no_dots(text, limit)
+
+def _repair_reply(text: Optional[str], closing: str = "") -> Optional[str]:
+    t = str(text or "").strip()
+    if not t:
+        return None
+
+    t = CODE_FENCE_RE.sub(" ", t)
+    t = MD_LINK_RE.sub(r"\1", t)
+    t = HTML_TAG_RE.sub(" ", t)
+    t = unescape(t)
+    t = URL_RE.sub("", t)
+    t = MD_LINE_RE.sub("", t)
+    t = MD_INLINE_RE.sub(lambda m: m.group(2) if m.group(1) else m.group(3), t)
+    t = EMOJI_RUN_RE.sub(_collapse_emoji_run, t)
+
+    lines = [re.sub(r"[ \t\u00A0]+", " ", ln).strip() for ln in t.splitlines()]
+    t = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+    t = _strip_closing(t)
+
+    limit = _perf["max_chars"] - (len(closing) + 2 if closing else 0)
+    t = _trim_sentences(t, limit)
+    if len(t) < _perf["min_chars"]:
+        return None
+    return f"{t}\n\n{closing}" if closing else t
 
-    url = IO_CHAT_URL
+_usage_stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
+
+def _record_usage(usage: Optional[dict]):
+    if not isinstance(usage, dict):
+        return
+    details = usage.get("prompt_tokens_details") or {}
+    cached = details.get("cached_tokens") if isinstance(details, dict) else None
+    if cached is None:
+        cached = usage.get("cached_tokens", usage.get("prompt_cache_hit_tokens"))
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    with _usage_lock:
+        _usage_stats["requests"] += 1
+        _usage_stats["prompt_tokens"] += prompt_tokens
+        _usage_stats["completion_tokens"] += completion_tokens
+        _usage_stats["cached_tokens"] += int(cached or 0)
+    logkv(logging.INFO, "llm_usage", key="llm_usage", stage="generate", prompt=PROMPT_ID,
+          prompt_tokens=prompt_tokens, cached_tokens=cached, completion_tokens=completion_tokens,
+          order_id=getattr(_trace_ctx, "oid", None))
+
+def _usage_text() -> str:
+    with _usage_lock:
+        u = dict(_usage_stats)
+    if not u["requests"]:
+        return ""
+    pct = 100.0 * u["cached_tokens"] / u["prompt_tokens"] if u["prompt_tokens"] else 0.0
+    return f"Кэш промпта: {pct:.0f}% ({u['cached_tokens']}/{u['prompt_tokens']} ток., {u['requests']} запр.)\n"
+
+def _chat_request(prompt: str, api_key: str, model: str, attempt: int = 1,
+                  system: str = SYSTEM_PROMPT, url: Optional[str] = None,
+                  temperature: Optional[float] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"content": None, "usage": None, "latency": 0.0, "error": None}
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
         "Accept": "application/json",
     }
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
     payload = {
         "model": model or DEFAULT_MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": IO_TEMPERATURE,
+        "messages": messages,
+        "temperature": _perf["temperature"] if temperature is None else temperature,
     }
+    t0 = time.perf_counter()
+    try:
+        resp = _http_post(url or IO_CHAT_URL, headers, payload, timeout or _perf["timeout"])
+        result["latency"] = time.perf_counter() - t0
+        if resp.status_code >= 400:
+            result["error"] = f"http_{resp.status_code}"
+            logkv(logging.WARNING, "llm_http_error", key=f"llm_http:{resp.status_code}", stage="generate",
+                  status=resp.status_code, attempt=attempt, model=model, order_id=getattr(_trace_ctx, "oid", None),
+                  body=(resp.text or "")[:300])
+            return result
+
+        data = resp.json()
+        result["usage"] = data.get("usage") if isinstance(data.get("usage"), dict) else None
+        content = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
+        result["content"] = (content or "").strip()
+        return result
 
-    for attempt in range(1, MAX_ATTEMPTS + 1):
+    except Exception as e:
+        result["latency"] = time.perf_counter() - t0
+        result["error"] = type(e).__name__
+        logkv(logging.ERROR, "llm_request_error", key=f"llm_err:{type(e).__name__}", stage="generate",
+              error=type(e).__name__, attempt=attempt, model=model, order_id=getattr(_trace_ctx, "oid", None),
+              detail=str(e)[:200])
+        return result
+
+_pool_enabled = False
+_pool_lock = threading.Lock()
+_pool_cv = threading.Condition()
+_pool_listener: Optional[Listener] = None
+_pool_queues: Dict[str, deque] = {}
+_pool_served: Dict[str, int] = {}
+
+def _pool_problem() -> Optional[str]:
+    if len(POOL_AUTHKEY) < POOL_MIN_KEY_LEN or POOL_AUTHKEY == UUID.encode():
+        return f"задай секрет GPTFEEDBACK_POOL_KEY (от {POOL_MIN_KEY_LEN} символов)"
+    if POOL_ADDRESS[0] not in ("127.0.0.1", "localhost", "::1") and not POOL_ALLOW_REMOTE:
+        return "GPTFEEDBACK_POOL_HOST не loopback, нужен GPTFEEDBACK_POOL_ALLOW_REMOTE=1"
+    return None
+
+def _set_pool(on: bool) -> Optional[str]:
+    global _pool_enabled
+    problem = _pool_problem() if on else None
+    if problem:
+        logw(f"общий пул не включён: {problem}", key="pool_refused")
+    _pool_enabled = bool(on) and not problem
+    if _pool_enabled:
+        _pool_start_server()
+    return problem
+
+def _pool_send(conn, obj: dict):
+    conn.send_bytes(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+def _pool_recv(conn) -> Any:
+    return json.loads(conn.recv_bytes(POOL_MAX_MESSAGE).decode("utf-8"))
+
+def _pool_valid_request(req: Any) -> bool:
+    if not isinstance(req, dict):
+        return False
+    if not all(isinstance(req.get(k), str) for k in ("account", "prompt", "api_key", "model", "system")):
+        return False
+    if not isinstance(req.get("attempt", 1), int):
+        return False
+    return all(req.get(k) is None or isinstance(req.get(k), (int, float)) for k in ("temperature", "timeout"))
+
+def _pool_valid_result(res: Any) -> bool:
+    return (isinstance(res, dict)
+            and (res.get("content") is None or isinstance(res.get("content"), str))
+            and (res.get("usage") is None or isinstance(res.get("usage"), dict))
+            and isinstance(res.get("latency"), (int, float))
+            and (res.get("error") is None or isinstance(res.get("error"), str)))
+
+def _pool_start_server() -> bool:
+    global _pool_listener
+    with _pool_lock:
+        if _pool_listener is not None:
+            return True
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=IO_TIMEOUT)
-            if resp.status_code >= 400:
-                logw(f"IO HTTP {resp.status_code} (attempt {attempt}): {(resp.text or '')[:300]}")
-                time.sleep(1)
-                continue
+            _pool_listener = Listener(POOL_ADDRESS, backlog=64, authkey=POOL_AUTHKEY)
+        except OSError:
+            return False
+        threading.Thread(target=_pool_accept_loop, name="gpt-feedback-pool", daemon=True).start()
+        threading.Thread(target=_pool_scheduler, name="gpt-feedback-pool-sched", daemon=True).start()
+    logi(f"общий пул генерации запущен на {POOL_ADDRESS[0]}:{POOL_ADDRESS[1]}")
+    return True
 
-            data = resp.json()
-            content = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
-            content = (content or "").strip()
+def _pool_accept_loop():
+    while True:
+        try:
+            conn = _pool_listener.accept()
+        except Exception as e:
+            logw(f"pool accept failed: {e}", key="pool_accept")
+            time.sleep(0.5)
+            continue
+        threading.Thread(target=_pool_handle, args=(conn,), name="gpt-feedback-pool-conn", daemon=True).start()
 
-            if len(content) < MIN_CHARACTERS:
-                logw(f"Model ответ слишком короткий (len={len(content)}) attempt {attempt}")
-                continue
+def _pool_handle(conn):
+    item: Dict[str, Any] = {"done": threading.Event(), "result": None, "cancelled": False}
+    try:
+        item["req"] = req = _pool_recv(conn)
+        if not _pool_valid_request(req):
+            logw("pool: отклонён запрос неверного формата", key="pool_bad_request")
+            _pool_send(conn, {"content": None, "usage": None, "latency": 0.0, "error": "pool_bad_request"})
+            return
+        account = req["account"][:64] or "?"
+        with _pool_cv:
+            _pool_queues.setdefault(account, deque()).append(item)
+            _pool_cv.notify()
+        if not item["done"].wait(POOL_WAIT):
+            item["cancelled"] = True
+        _pool_send(conn, item["result"] or {"content": None, "usage": None, "latency": 0.0, "error": "pool_timeout"})
+    except Exception as e:
+        item["cancelled"] = True
+        logw(f"pool request failed: {e}", key="pool_conn")
+    finally:
+        conn.close()
+
+def _pool_next(last: Optional[str]) -> tuple:
+    ready = sorted(k for k, q in _pool_queues.items() if q)
+    account = next((k for k in ready if last is None or k > last), ready[0])
+    return account, _pool_queues[account].popleft()
+
+def _pool_scheduler():
+    slots = threading.BoundedSemaphore(POOL_WORKERS)
+    last: Optional[str] = None
+    next_at = 0.0
+    while True:
+        with _pool_cv:
+            while not any(_pool_queues.values()):
+                _pool_cv.wait()
+            last, item = _pool_next(last)
+        if item["cancelled"]:
+            continue
+        wait = next_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        next_at = max(next_at, time.monotonic()) + 60.0 / max(1, _perf["pool_rpm"])
+        slots.acquire()
+        threading.Thread(target=_pool_execute, args=(last, item, slots), name="gpt-feedback-pool-run", daemon=True).start()
+
+def _pool_execute(account: str, item: Dict[str, Any], slots: threading.BoundedSemaphore):
+    req = item["req"]
+    try:
+        timeout = req.get("timeout")
+        item["result"] = _chat_request(req["prompt"], req["api_key"], req["model"], req.get("attempt", 1),
+                                       req["system"], temperature=req.get("temperature"),
+                                       timeout=min(float(timeout), PERF_FIELDS["timeout"][3]) if timeout else None)
+    except Exception as e:
+        item["result"] = {"content": None, "usage": None, "latency": 0.0, "error": type(e).__name__}
+    finally:
+        with _pool_cv:
+            _pool_served[account] = _pool_served.get(account, 0) + 1
+        slots.release()
+        item["done"].set()
+
+def _pool_request(prompt: str, api_key: str, model: str, attempt: int, system: str) -> Optional[Dict[str, Any]]:
+    req = {
+        "account": _namespace or "default", "prompt": prompt, "api_key": api_key, "model": model, "attempt": attempt,
+        "system": system, "temperature": _perf["temperature"], "timeout": _perf["timeout"],
+    }
+    for _ in range(2):
+        try:
+            conn = Client(POOL_ADDRESS, authkey=POOL_AUTHKEY)
+        except Exception as e:
+            if not _pool_start_server():
+                logw(f"общий пул недоступен: {e}", key="pool_connect")
+                time.sleep(0.2)
+            continue
+        try:
+            _pool_send(conn, req)
+            if not conn.poll(POOL_WAIT):
+                return None
+            res = _pool_recv(conn)
+            if not _pool_valid_result(res):
+                logw("общий пул вернул ответ неверного формата", key="pool_bad_result")
+                return None
+            return res
+        except Exception as e:
+            logw(f"общий пул оборвал запрос: {e}", key="pool_io")
+            return None
+        finally:
+            conn.close()
+    return None
+
+def _pool_text() -> str:
+    if not _pool_enabled:
+        problem = _pool_problem()
+        return f"❌ ВЫКЛ ({escape(problem)})" if problem else "❌ ВЫКЛ"
+    if _pool_listener is None:
+        return f"✅ клиент ({POOL_ADDRESS[1]})"
+    with _pool_cv:
+        served = ", ".join(f"{k}: {v}" for k, v in sorted(_pool_served.items()))
+        queued = sum(len(q) for q in _pool_queues.values())
+    return f"✅ сервер ({POOL_ADDRESS[1]}), в очереди {queued}" + (f", обслужено {escape(served)}" if served else "")
+
+def _chat_content(prompt: str, api_key: str, model: str, attempt: int = 1,
+                  system: str = SYSTEM_PROMPT) -> Optional[str]:
+    result = _pool_request(prompt, api_key, model, attempt, system) if _pool_enabled else None
+    if result is None:
+        result = _chat_request(prompt, api_key, model, attempt, system)
+    if result["content"] is not None:
+        _record_usage(result["usage"])
+    return result["content"]
+
+def generate_response(prompt: str, api_key: str, model: str, closing: str = "", system: str = SYSTEM_PROMPT) -> str:
+    if not api_key:
+        return "❌ API-ключ не настроен. Открой меню и укажи ключ (или задай env IOINTELLIGENCE_API_KEY / IONET_API_KEY)."
 
-            return _cut_700_no_dots(content, MAX_CHARACTERS)
+    for attempt in range(1, _perf["max_attempts"] + 1):
+        content = _chat_content(prompt, api_key, model, attempt, system)
+        if content is None:
+            time.sleep(RETRY_DELAY)
+            continue
 
-        except Exception as e:
-            loge(f"IO request error (attempt {attempt}): {e}")
-            time.sleep(1)
+        repaired = _repair_reply(content, closing)
+        if repaired is None:
+            logkv(logging.WARNING, "llm_unusable_reply", key="llm_unusable", stage="generate",
+                  length=len(content), attempt=attempt, order_id=getattr(_trace_ctx, "oid", None))
+            continue
+
+        return repaired
 
-    return "Спасибо за отзыв! 😊"
+    return FALLBACK_REPLY
 
 def _toggle(cardinal: "Cardinal", call):
     bot = cardinal.telegram.bot
@@ -680,6 +1651,129 @@ def _toggle(cardinal: "Cardinal", call):
 
     _safe_edit(bot, chat_id, call.message.id, _settings_text(cfg), _settings_kb())
 
+def _toggle_pregen(cardinal: "Cardinal", call):
+    bot = cardinal.telegram.bot
+    chat_id = call.message.chat.id
+
+    cfg = _get_config(load_data())
+    cfg["pregen"] = not bool(cfg.get("pregen"))
+    _set_config(cfg)
+    if not cfg["pregen"]:
+        _drafts_clear()
+
+    try:
+        bot.answer_callback_query(call.id, f"Черновики {'включены' if cfg['pregen'] else 'выключены'}"
+                                  + ("" if _pregen_useful(cfg) or not cfg["pregen"] else
+                                     ". Они готовятся без текста отзыва, поэтому работают только "
+                                     "при выключенном поле «Отзыв»."), show_alert=cfg["pregen"] and not _pregen_useful(cfg))
+    except Exception:
+        pass
+
+    _safe_edit(bot, chat_id, call.message.id, _settings_text(cfg), _settings_kb())
+
+def _toggle_trace(cardinal: "Cardinal", call):
+    global _trace_capped
+    bot = cardinal.telegram.bot
+    chat_id = call.message.chat.id
+
+    cfg = _get_config(load_data())
+    full = os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) > TRACE_MAX_BYTES
+    if not cfg.get("trace") and full:
+        try:
+            bot.answer_callback_query(call.id, f"❌ {TRACE_FILE} больше {TRACE_MAX_BYTES} байт, "
+                                               "перенеси или удали его", show_alert=True)
+        except Exception:
+            pass
+        return
+    cfg["trace"] = not bool(cfg.get("trace"))
+    if cfg["trace"]:
+        _trace_capped = False
+    _set_config(cfg)
+    _set_trace(cfg["trace"], cfg)
+
+    try:
+        bot.answer_callback_query(call.id, f"Запись трассы {'включена' if cfg['trace'] else 'выключена'}")
+    except Exception:
+        pass
+
+    _safe_edit(bot, chat_id, call.message.id, _settings_text(cfg), _settings_kb())
+
+def _toggle_pool(cardinal: "Cardinal", call):
+    bot = cardinal.telegram.bot
+    chat_id = call.message.chat.id
+
+    cfg = _get_config(load_data())
+    problem = _set_pool(not bool(cfg.get("pool")))
+    if not problem:
+        cfg["pool"] = not bool(cfg.get("pool"))
+        _set_config(cfg)
+
+    try:
+        bot.answer_callback_query(call.id, f"❌ {problem}" if problem else
+                                  f"Общий пул {'включён' if cfg['pool'] else 'выключен'}", show_alert=bool(problem))
+    except Exception:
+        pass
+
+    _safe_edit(bot, chat_id, call.message.id, _settings_text(cfg), _settings_kb())
+
+_probe_lock = threading.Lock()
+
+def _test_text(cfg: dict) -> str:
+    pr = cfg.get("probe") or {}
+    return (
+        "🧪 <b>Тест API</b>\n\n"
+        f"Модель: <code>{escape(cfg.get('model') or DEFAULT_MODEL)}</code>\n"
+        f"Endpoint: <code>{escape(IO_CHAT_URL)}</code>\n\n"
+        f"Проба: <b>{pr.get('n')}</b> запросов последовательно, затем <b>{pr.get('n')}</b> "
+        f"с параллельностью <b>{pr.get('concurrency')}</b>.\n"
+        "Меряет подключение, время до первого токена, полную задержку, ошибки и токены/с.\n"
+        "Результат придёт отдельным сообщением."
+    )
+
+def _test_kb(cfg: dict) -> InlineKeyboardMarkup:
+    pr = cfg.get("probe") or {}
+    kb = InlineKeyboardMarkup()
+    kb.row(
+        InlineKeyboardButton("💬 Один ответ", callback_data=CB_TEST_ONE),
+        InlineKeyboardButton("📊 Запустить пробу", callback_data=CB_PROBE_RUN),
+    )
+    kb.row(*[
+        InlineKeyboardButton(f"{'✅' if n == pr.get('n') else ''}N={n}", callback_data=f"{CB_PROBE_N}:{n}")
+        for n in PROBE_N_OPTIONS
+    ])
+    kb.row(*[
+        InlineKeyboardButton(f"{'✅' if c == pr.get('concurrency') else ''}×{c}", callback_data=f"{CB_PROBE_C}:{c}")
+        for c in PROBE_C_OPTIONS
+    ])
+    kb.row(InlineKeyboardButton("◀️ Назад", callback_data=CB_SETTINGS))
+    return kb
+
+def _test_open(cardinal: "Cardinal", call):
+    bot = cardinal.telegram.bot
+    cfg = _get_config(load_data())
+
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+    _safe_edit(bot, call.message.chat.id, call.message.id, _test_text(cfg), _test_kb(cfg))
+
+def _probe_set(cardinal: "Cardinal", call, key: str, value: int):
+    bot = cardinal.telegram.bot
+    cfg = _get_config(load_data())
+    allowed = PROBE_N_OPTIONS if key == "n" else PROBE_C_OPTIONS
+    if value in allowed:
+        cfg["probe"] = {**(cfg.get("probe") or {}), key: value}
+        _set_config(cfg)
+
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+    _safe_edit(bot, call.message.chat.id, call.message.id, _test_text(cfg), _test_kb(cfg))
+
 def _test_api(cardinal: "Cardinal", call):
     bot = cardinal.telegram.bot
     chat_id = call.message.chat.id
@@ -688,21 +1782,201 @@ def _test_api(cardinal: "Cardinal", call):
     api_key = _get_api_key(cfg)
     model = cfg.get("model", DEFAULT_MODEL)
 
+    if not api_key:
+        try:
+            bot.answer_callback_query(call.id, "Сначала задай API ключ (🔑 API ключ) или установи env IOINTELLIGENCE_API_KEY / IONET_API_KEY.", show_alert=True)
+        except Exception:
+            pass
+        return
+
     try:
-        bot.answer_callback_query(call.id)
+        bot.answer_callback_query(call.id, "Запрос отправлен…")
     except Exception:
         pass
 
+    def run():
+        prompt = "Сгенерируй короткий дружелюбный ответ покупателю на отзыв: 'всё супер'. 1-2 предложения, с эмодзи."
+        t0 = time.perf_counter()
+        ans = generate_response(prompt, api_key, model, system="")
+        try:
+            bot.send_message(chat_id, f"🧪 Тест API ({time.perf_counter() - t0:.2f} с):\n\n{ans}")
+        except Exception as e:
+            loge(f"_test_api send failed: {e}")
+
+    threading.Thread(target=run, name="gpt-feedback-test", daemon=True).start()
+
+def _probe_connect(url: str, timeout: float) -> float:
+    u = urlparse(url)
+    port = u.port or (443 if u.scheme == "https" else 80)
+    t0 = time.perf_counter()
+    sock = socket.create_connection((u.hostname, port), timeout=timeout)
+    try:
+        if u.scheme == "https":
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=u.hostname)
+        return time.perf_counter() - t0
+    finally:
+        sock.close()
+
+def _probe_one(api_key: str, model: str) -> Dict[str, Any]:
+    r: Dict[str, Any] = {"connect": None, "ttft": None, "total": None, "tokens": 0, "chunks": 0, "error": None}
+    timeout = _perf["timeout"]
+    try:
+        r["connect"] = _probe_connect(IO_CHAT_URL, timeout)
+    except Exception as e:
+        r["error"] = f"connect:{type(e).__name__}"
+        return r
+
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": DEFAULT_PROMPT_TEMPLATE.format(info_block=PROBE_INFO_BLOCK)},
+        ],
+        "temperature": _perf["temperature"],
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json", "Accept": "text/event-stream"}
+    t0 = time.perf_counter()
+    chunks = 0
+    try:
+        resp = requests.post(IO_CHAT_URL, headers=headers, json=payload, timeout=timeout, stream=True)
+        if resp.status_code in (400, 422):
+            resp.close()
+            payload.pop("stream_options")
+            t0 = time.perf_counter()
+            resp = requests.post(IO_CHAT_URL, headers=headers, json=payload, timeout=timeout, stream=True)
+        try:
+            if resp.status_code >= 400:
+                r["error"] = f"http_{resp.status_code}"
+                return r
+            for raw in resp.iter_lines(decode_unicode=True):
+                if not raw or not raw.startswith("data:"):
+                    continue
+                data = raw[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    obj = json.loads(data)
+                except Exception:
+                    r["error"] = "parse"
+                    continue
+                usage = obj.get("usage")
+                if isinstance(usage, dict) and usage.get("completion_tokens"):
+                    r["tokens"] = int(usage["completion_tokens"])
+                delta = ((obj.get("choices") or [{}])[0].get("delta") or {}).get("content")
+                if delta:
+                    chunks += 1
+                    if r["ttft"] is None:
+                        r["ttft"] = time.perf_counter() - t0
+        finally:
+            resp.close()
+    except requests.exceptions.Timeout:
+        r["error"] = "timeout"
+        return r
+    except requests.exceptions.ConnectionError:
+        r["error"] = "connection"
+        return r
+    except Exception as e:
+        r["error"] = type(e).__name__
+        return r
+
+    r["total"] = time.perf_counter() - t0
+    r["chunks"] = chunks
+    if r["ttft"] is None and not r["error"]:
+        r["error"] = "empty"
+    return r
+
+def _probe_summary(title: str, results: list, wall: float) -> str:
+    ok = [x for x in results if not x["error"]]
+    errors: Dict[str, int] = {}
+    for x in results:
+        if x["error"]:
+            errors[x["error"]] = errors.get(x["error"], 0) + 1
+
+    def pct(key: str) -> str:
+        vals = [x[key] * 1000 for x in results if x.get(key) is not None]
+        if not vals:
+            return "—"
+        return " ".join(f"p{p} {_percentile(vals, p):.0f}" for p in (50, 90, 99)) + " мс"
+
+    tps = [x["tokens"] / (x["total"] - x["ttft"]) for x in ok if x["tokens"] and x["total"] > x["ttft"]]
+    cps = [x["chunks"] / (x["total"] - x["ttft"]) for x in ok
+           if not x["tokens"] and x["chunks"] and x["total"] > x["ttft"]]
+    lines = [
+        title,
+        f"  ок       {len(ok)}/{len(results)} за {wall:.1f} с ({len(results) / wall if wall else 0:.2f} запр/с)",
+        f"  TCP+TLS  {pct('connect')} (отдельное соединение)",
+        f"  TTFT     {pct('ttft')}",
+        f"  total    {pct('total')}",
+        f"  ток/с    {sum(tps) / len(tps):.1f}" if tps else "  ток/с    — (провайдер не вернул usage)",
+    ]
+    if cps:
+        lines.append(f"  чанк/с   {sum(cps) / len(cps):.1f} (без usage, {len(cps)} запр.)")
+    if errors:
+        lines.append("  ошибки   " + ", ".join(f"{k}×{v}" for k, v in sorted(errors.items())))
+    return "\n".join(lines)
+
+def _probe_run(cardinal: "Cardinal", call):
+    bot = cardinal.telegram.bot
+    chat_id = call.message.chat.id
+    cfg = _get_config(load_data())
+    api_key = _get_api_key(cfg)
+    model = cfg.get("model", DEFAULT_MODEL)
+    pr = cfg.get("probe") or {}
+    n, conc = int(pr.get("n") or 10), int(pr.get("concurrency") or 1)
+
     if not api_key:
         try:
-            bot.answer_callback_query(call.id, "Сначала задай API ключ (🔑 API ключ) или установи env IOINTELLIGENCE_API_KEY / IONET_API_KEY.", show_alert=True)
+            bot.answer_callback_query(call.id, "Сначала задай API ключ (🔑 API ключ).", show_alert=True)
+        except Exception:
+            pass
+        return
+    if not _probe_lock.acquire(blocking=False):
+        try:
+            bot.answer_callback_query(call.id, "Проба уже идёт.", show_alert=True)
         except Exception:
             pass
         return
 
-    prompt = "Сгенерируй короткий дружелюбный ответ покупателю на отзыв: 'всё супер'. 1-2 предложения, с эмодзи."
-    ans = generate_response(prompt, api_key, model)
-    bot.send_message(chat_id, f"🧪 Тест API:\n\n{ans}")
+    try:
+        bot.answer_callback_query(call.id, "Проба запущена…")
+    except Exception:
+        pass
+
+    def run():
+        try:
+            msg = bot.send_message(chat_id, f"⏳ Проба: {n} последовательно + {n} ×{conc}…")
+            t0 = time.perf_counter()
+            seq = [_probe_one(api_key, model) for _ in range(n)]
+            seq_wall = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=conc, thread_name_prefix="gpt-feedback-probe") as pool:
+                par = list(pool.map(lambda _: _probe_one(api_key, model), range(n)))
+            par_wall = time.perf_counter() - t0
+
+            report = "\n\n".join([
+                _probe_summary(f"Последовательно, N={n}", seq, seq_wall),
+                _probe_summary(f"Параллельно ×{conc}, N={n}", par, par_wall),
+            ])
+            text = f"📊 <b>Проба API</b> · <code>{escape(model)}</code>\n\n<pre>{escape(report)}</pre>"
+            logkv(logging.INFO, "probe_done", model=model, n=n, concurrency=conc,
+                  seq_errors=sum(1 for x in seq if x["error"]), par_errors=sum(1 for x in par if x["error"]))
+            try:
+                _safe_edit(bot, chat_id, msg.message_id, text)
+            except Exception:
+                bot.send_message(chat_id, text, parse_mode="HTML")
+        except Exception as e:
+            loge(f"_probe_run failed: {e}")
+            try:
+                bot.send_message(chat_id, f"❌ Проба упала: {e}")
+            except Exception:
+                pass
+        finally:
+            _probe_lock.release()
+
+    threading.Thread(target=run, name="gpt-feedback-probe", daemon=True).start()
 
 def _delete_menu_text() -> str:
     return (
@@ -810,6 +2084,317 @@ def _go_main_menu(cardinal: "Cardinal", call):
 
     open_welcome(cardinal, call)
 
+_history_lock = threading.Lock()
+_history_ready = False
+_history_fts = False
+_history_q: Dict[int, str] = {}
+
+def _history_conn() -> sqlite3.Connection:
+    global _history_ready, _history_fts
+    conn = sqlite3.connect(HISTORY_DB, timeout=10)
+    if _history_ready:
+        return conn
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS replies (
+            id INTEGER PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            order_id TEXT NOT NULL,
+            buyer TEXT COLLATE NOCASE,
+            item TEXT COLLATE NOCASE,
+            stars INTEGER,
+            review TEXT,
+            reply TEXT,
+            model TEXT,
+            latency_ms INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_replies_buyer ON replies(buyer, ts);
+        CREATE INDEX IF NOT EXISTS idx_replies_item ON replies(item, ts);
+        CREATE INDEX IF NOT EXISTS idx_replies_ts ON replies(ts);
+        CREATE INDEX IF NOT EXISTS idx_replies_order ON replies(order_id);
+    """)
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS replies_fts USING fts5("
+            "buyer, item, review, reply, content='replies', content_rowid='id')"
+        )
+        _history_fts = True
+    except sqlite3.OperationalError as e:
+        logw(f"FTS5 недоступен, поиск по истории через LIKE: {e}")
+        _history_fts = False
+    conn.commit()
+    _history_ready = True
+    return conn
+
+def _history_add(order_id: str, vals: Dict[str, str], stars: int, reply: str, model: str, latency_ms: int):
+    row = (int(time.time()), order_id, vals["name"], vals["item"], int(stars), vals["text"], reply, model, int(latency_ms))
+    try:
+        with _history_lock:
+            conn = _history_conn()
+            try:
+                cur = conn.execute(
+                    "INSERT INTO replies (ts, order_id, buyer, item, stars, review, reply, model, latency_ms) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                if _history_fts:
+                    conn.execute(
+                        "INSERT INTO replies_fts (rowid, buyer, item, review, reply) VALUES (?, ?, ?, ?, ?)",
+                        (cur.lastrowid, row[2], row[3], row[5], row[6]))
+                conn.commit()
+            finally:
+                conn.close()
+    except Exception as e:
+        loge(f"_history_add({order_id}) failed: {e}", key="history_add")
+
+def _parse_history_date(s: str) -> Optional[datetime]:
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d.%m"):
+        try:
+            d = datetime.strptime(s, fmt)
+            return d.replace(year=datetime.now().year) if fmt == "%d.%m" else d
+        except ValueError:
+            continue
+    return None
+
+def _history_where(query: str) -> tuple:
+    where, args, words = [], [], []
+    for tok in (query or "").split():
+        key, _, val = tok.partition(":")
+        key = key.lower()
+        if val and key in ("buyer", "покупатель"):
+            where.append("r.buyer = ?")
+            args.append(val)
+        elif val and key in ("item", "товар"):
+            where.append("r.item LIKE ?")
+            args.append(val.replace("%", "").replace("_", "") + "%")
+        elif val and key in ("stars", "звёзды", "звезды") and val.isdigit():
+            where.append("r.stars = ?")
+            args.append(int(val))
+        elif val and key in ("date", "дата") and _parse_history_date(val):
+            d = _parse_history_date(val)
+            start = int(d.timestamp())
+            where.append("r.ts >= ? AND r.ts < ?")
+            args.extend([start, start + 86400])
+        elif tok.startswith("#") and len(tok) > 1:
+            where.append("r.order_id = ?")
+            args.append(tok[1:])
+        else:
+            words.append(tok)
+
+    join = ""
+    if words:
+        if _history_fts:
+            join = "JOIN replies_fts f ON f.rowid = r.id"
+            where.append("replies_fts MATCH ?")
+            args.append(" ".join('"' + w.replace('"', '""') + '"' for w in words))
+        else:
+            for w in words:
+                where.append("(r.review LIKE ? OR r.reply LIKE ? OR r.item LIKE ? OR r.buyer LIKE ?)")
+                args.extend([f"%{w}%"] * 4)
+    return join, (" WHERE " + " AND ".join(where)) if where else "", args
+
+def _history_search(query: str, page: int) -> tuple:
+    with _history_lock:
+        conn = _history_conn()
+    try:
+        join, where, args = _history_where(query)
+        total = conn.execute(f"SELECT COUNT(*) FROM replies r {join}{where}", args).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT r.ts, r.order_id, r.buyer, r.item, r.stars, r.review, r.reply, r.model, r.latency_ms "
+            f"FROM replies r {join}{where} ORDER BY r.id DESC LIMIT ? OFFSET ?",
+            args + [HISTORY_PAGE_SIZE, page * HISTORY_PAGE_SIZE]).fetchall()
+        return total, rows
+    finally:
+        conn.close()
+
+def _history_text(query: str, page: int, total: int, rows: list) -> str:
+    pages = max(1, (total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE)
+    head = (
+        "📜 <b>История ответов</b>\n"
+        f"Запрос: <code>{escape(query) if query else '—'}</code>\n"
+        f"Найдено: <b>{total}</b> · стр. {page + 1}/{pages}"
+    )
+    if not rows:
+        return head + "\n\nНичего не найдено.\n\n" + (
+            "Фильтры: <code>buyer:ник</code> <code>item:товар</code> <code>stars:5</code> "
+            "<code>date:2024-01-31</code> <code>#ORDERID</code>, остальное — полнотекстовый поиск."
+        )
+    parts = [head]
+    for ts, order_id, buyer, item, stars, review, reply, model, latency_ms in rows:
+        parts.append(
+            f"\n📅 {datetime.fromtimestamp(ts).strftime('%d.%m.%Y %H:%M')} · <code>#{escape(order_id)}</code> · "
+            f"{stars}⭐ · {escape(buyer or '—')}\n"
+            f"🛒 {escape((item or '—')[:80])}\n"
+            f"💬 {escape((review or '—')[:150])}\n"
+            f"↩️ {escape((reply or '')[:300])}\n"
+            f"🤖 <code>{escape(model or '—')}</code> · {latency_ms} мс"
+        )
+    return "\n".join(parts)
+
+def _history_kb(page: int, total: int) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup()
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"{CB_HISTORY}:{page - 1}"))
+    if (page + 1) * HISTORY_PAGE_SIZE < total:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"{CB_HISTORY}:{page + 1}"))
+    if nav:
+        kb.row(*nav)
+    kb.row(InlineKeyboardButton("◀️ Назад", callback_data=CB_WELCOME))
+    return kb
+
+def _history_command(cardinal: "Cardinal", message):
+    bot = cardinal.telegram.bot
+    chat_id = message.chat.id
+    parts = (getattr(message, "text", "") or "").split(maxsplit=1)
+    query = parts[1].strip() if len(parts) > 1 else ""
+    _history_q[chat_id] = query
+    try:
+        total, rows = _history_search(query, 0)
+    except Exception as e:
+        loge(f"_history_search failed: {e}")
+        bot.send_message(chat_id, f"❌ Ошибка поиска: {e}")
+        return
+    bot.send_message(chat_id, _history_text(query, 0, total, rows), parse_mode="HTML",
+                     reply_markup=_history_kb(0, total), disable_web_page_preview=True)
+
+def _history_page(cardinal: "Cardinal", call, page: Optional[int]):
+    bot = cardinal.telegram.bot
+    chat_id = call.message.chat.id
+    if page is None:
+        _history_q[chat_id] = ""
+        page = 0
+    query = _history_q.get(chat_id, "")
+
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+    try:
+        total, rows = _history_search(query, max(0, page))
+    except Exception as e:
+        loge(f"_history_search failed: {e}")
+        return
+    _safe_edit(bot, chat_id, call.message.id, _history_text(query, page, total, rows), _history_kb(page, total))
+
+_profile_lock = threading.Lock()
+
+def _is_admin(cardinal: "Cardinal", user_id) -> bool:
+    users = getattr(cardinal.telegram, "authorized_users", []) or []
+    return any(str(u) == str(user_id) for u in users)
+
+def _frame_label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno} {code.co_name}"
+
+def _sample_profile(seconds: float) -> tuple:
+    plugin_file = os.path.abspath(__file__)
+    me = threading.get_ident()
+    self_counts: Dict[str, int] = {}
+    cum_counts: Dict[str, int] = {}
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            f = frame
+            while f is not None:
+                stack.append(f.f_code)
+                f = f.f_back
+            if (os.path.basename(stack[0].co_filename), stack[0].co_name) in PROFILE_IDLE_FRAMES:
+                continue
+            if not any(os.path.abspath(c.co_filename) == plugin_file for c in stack):
+                continue
+            samples += 1
+            top = _frame_label(stack[0])
+            self_counts[top] = self_counts.get(top, 0) + 1
+            for label in {_frame_label(c) for c in stack}:
+                cum_counts[label] = cum_counts.get(label, 0) + 1
+        time.sleep(PROFILE_INTERVAL)
+    return samples, self_counts, cum_counts
+
+def _profile_report(seconds: float, top: int, samples: int, self_counts: dict, cum_counts: dict,
+                    mem_stats: Optional[list]) -> str:
+    out = [
+        f"{NAME} {VERSION} profile",
+        f"date: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}",
+        f"duration: {seconds:.0f}s, interval: {PROFILE_INTERVAL * 1000:.0f}ms, samples in plugin code: {samples}",
+        "",
+    ]
+    for title, counts in (("TOP self (where threads were)", self_counts), ("TOP cumulative (on stack)", cum_counts)):
+        out.append(title)
+        if not counts:
+            out.append("  (no samples — plugin code was idle)")
+        for label, n in sorted(counts.items(), key=lambda kv: -kv[1])[:top]:
+            out.append(f"  {n:>7}  {100.0 * n / max(1, samples):5.1f}%  {label}")
+        out.append("")
+    if mem_stats is not None:
+        plugin_name = os.path.basename(__file__)
+        out.append("TOP allocations (size diff, all code)")
+        for st in mem_stats[:top]:
+            out.append(f"  {st.size_diff / 1024:>10.1f} KiB  {st.count_diff:>+8}  {st.traceback[-1]}")
+        out.append("")
+        out.append(f"TOP allocations from {plugin_name}")
+        own = [st for st in mem_stats if any(os.path.basename(fr.filename) == plugin_name for fr in st.traceback)]
+        for st in own[:top]:
+            frame = next(fr for fr in reversed(st.traceback) if os.path.basename(fr.filename) == plugin_name)
+            out.append(f"  {st.size_diff / 1024:>10.1f} KiB  {st.count_diff:>+8}  {frame}  -> {st.traceback[-1]}")
+        if not own:
+            out.append("  (nothing)")
+    return "\n".join(out) + "\n"
+
+def _profile_command(cardinal: "Cardinal", message):
+    bot = cardinal.telegram.bot
+    chat_id = message.chat.id
+    if not _is_admin(cardinal, getattr(getattr(message, "from_user", None), "id", None)):
+        return
+
+    args = (getattr(message, "text", "") or "").split()[1:]
+    seconds, top, mem = PROFILE_DEFAULT_SECONDS, PROFILE_DEFAULT_TOP, False
+    for a in args:
+        if a.lower() in ("mem", "memory", "tracemalloc"):
+            mem = True
+        elif a.lower().startswith("top") and a[3:].isdigit():
+            top = max(5, min(200, int(a[3:])))
+        elif a.isdigit():
+            seconds = max(1, min(PROFILE_MAX_SECONDS, int(a)))
+
+    if not _profile_lock.acquire(blocking=False):
+        bot.send_message(chat_id, "⏳ Профилирование уже идёт.")
+        return
+
+    def run():
+        started_tracing = False
+        try:
+            bot.send_message(chat_id, f"⏳ Профилирую {seconds} с{' + tracemalloc' if mem else ''}…")
+            snap1 = None
+            if mem:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(25)
+                    started_tracing = True
+                snap1 = tracemalloc.take_snapshot()
+            samples, self_counts, cum_counts = _sample_profile(seconds)
+            mem_stats = None
+            if mem and snap1 is not None:
+                mem_stats = tracemalloc.take_snapshot().compare_to(snap1, "traceback")
+                mem_stats.sort(key=lambda st: -st.size_diff)
+            report = _profile_report(seconds, top, samples, self_counts, cum_counts, mem_stats)
+            doc = io.BytesIO(report.encode("utf-8"))
+            doc.name = f"gpt_feedback_profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+            bot.send_document(chat_id, doc, caption=f"📈 {NAME}: профиль за {seconds} с, сэмплов: {samples}")
+        except Exception as e:
+            loge(f"_profile_command failed: {e}")
+            try:
+                bot.send_message(chat_id, f"❌ Профилирование упало: {e}")
+            except Exception:
+                pass
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            _profile_lock.release()
+
+    threading.Thread(target=run, name="gpt-feedback-profile", daemon=True).start()
+
 def _should_handle_event_type(msg_type) -> bool:
     types = {MessageTypes.NEW_FEEDBACK, MessageTypes.FEEDBACK_CHANGED}
     fd = getattr(MessageTypes, "FEEDBACK_DELETED", None)
@@ -840,21 +2425,557 @@ def _buyer_review_fingerprint(order) -> str:
     text = getattr(review, "text", None) if review else None
     return _hash_review(stars, text)
 
-def _delete_our_reply(cardinal: "Cardinal", order_id: str):
+def _get_order(cardinal: "Cardinal", order_id: str):
+    t0 = time.perf_counter()
+    try:
+        order = cardinal.account.get_order(order_id)
+    except Exception as e:
+        _trace("order", oid=order_id, lat=round(time.perf_counter() - t0, 3), err=type(e).__name__)
+        raise
+    if _trace_enabled:
+        _trace("order", oid=order_id, lat=round(time.perf_counter() - t0, 3), f=_trace_order_fields(order))
+    return order
+
+def _delete_our_reply(cardinal: "Cardinal", order_id: str) -> Optional[Exception]:
+    t0 = time.perf_counter()
     try:
         cardinal.account.delete_review(order_id)
-        logi(f"✅ delete_review({order_id}) OK")
+        _trace("delete", oid=order_id, lat=round(time.perf_counter() - t0, 3), ok=True)
+        logkv(logging.INFO, "delete_review", order_id=order_id, stage="delete", ok=True,
+              duration_ms=round((time.perf_counter() - t0) * 1000))
+        return None
+    except Exception as e:
+        _trace("delete", oid=order_id, lat=round(time.perf_counter() - t0, 3), ok=False)
+        logkv(logging.ERROR, "delete_review", key="delete_review_failed", order_id=order_id, stage="delete", ok=False,
+              duration_ms=round((time.perf_counter() - t0) * 1000), error=str(e)[:200])
+        return e
+
+def _send_or_edit_reply(cardinal: "Cardinal", order_id: str, stars: int, text: str) -> Optional[Exception]:
+    t0 = time.perf_counter()
+    try:
+        cardinal.account.send_review(order_id=order_id, rating=int(stars), text=_cut_700_no_dots(text))
+        _trace("send", oid=order_id, lat=round(time.perf_counter() - t0, 3), ok=True)
+        logkv(logging.INFO, "send_review", order_id=order_id, stage="send", ok=True,
+              duration_ms=round((time.perf_counter() - t0) * 1000))
+        return None
     except Exception as e:
-        loge(f"delete_review({order_id}) failed: {e}")
-        _notify(cardinal, f"❌ {NAME}: не смог удалить ответ для заказа #{order_id}: {e}")
+        _trace("send", oid=order_id, lat=round(time.perf_counter() - t0, 3), ok=False)
+        logkv(logging.ERROR, "send_review", key="send_review_failed", order_id=order_id, stage="send", ok=False,
+              duration_ms=round((time.perf_counter() - t0) * 1000), error=str(e)[:200])
+        return e
+
+_outbox: Optional[Dict[str, Dict[str, Any]]] = None
+_outbox_lock = threading.RLock()
+_outbox_wake = threading.Event()
+_outbox_thread: Optional[threading.Thread] = None
+_outbox_cardinal: Optional["Cardinal"] = None
+_outbox_seq = 0
+
+def _outbox_items() -> Dict[str, Dict[str, Any]]:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = {k: v for k, v in _load_json(OUTBOX_FILE).items() if isinstance(v, dict)}
+        return _outbox
+
+def _outbox_save():
+    with _outbox_lock:
+        _save_json(OUTBOX_FILE, _outbox_items())
+
+def _outbox_get(order_id: str) -> Optional[Dict[str, Any]]:
+    with _outbox_lock:
+        entry = _outbox_items().get(order_id)
+        return dict(entry) if entry else None
+
+def _outbox_put(order_id: str, entry: Dict[str, Any]):
+    global _outbox_seq
+    with _outbox_lock:
+        items = _outbox_items()
+        old = items.get(order_id)
+        if old:
+            logkv(logging.INFO, "outbox_superseded", order_id=order_id, old_op=old.get("op"), new_op=entry.get("op"))
+        _outbox_seq += 1
+        entry.update({"seq": f"{time.time():.6f}:{_outbox_seq}", "attempts": 0, "next_at": 0.0, "created": int(time.time())})
+        items[order_id] = entry
+        _outbox_save()
+    _outbox_wake.set()
+
+def _outbox_drop(order_id: str):
+    with _outbox_lock:
+        if _outbox_items().pop(order_id, None) is not None:
+            _outbox_save()
+
+def _outbox_commit(order_id: str, entry: Dict[str, Any]):
+    st = load_state()
+    if entry["op"] == "send":
+        st[order_id] = {"review_fp": entry.get("fp"), "stars": entry.get("stars"), "updated_at": int(time.time())}
+    else:
+        st.pop(order_id, None)
+    save_state(st)
+    if entry["op"] == "send":
+        _history_add(order_id, entry.get("vals") or {}, entry.get("stars") or 0, entry.get("text") or "",
+                     entry.get("model") or "", entry.get("latency_ms") or 0)
+
+def _outbox_worker():
+    last_write = 0.0
+    cooldown_until = 0.0
+    while True:
+        now = time.time()
+        with _outbox_lock:
+            due = sorted(_outbox_items().items(), key=lambda kv: kv[1].get("next_at", 0))
+        wait = 30.0
+        if due:
+            wait = max(0.0, due[0][1].get("next_at", 0) - now)
+        wait = max(wait, cooldown_until - now, last_write + _perf["outbox_interval"] - now)
+        if wait > 0:
+            _outbox_wake.wait(min(wait, 30.0))
+            _outbox_wake.clear()
+            continue
+
+        order_id, entry = due[0]
+        cardinal = _outbox_cardinal
+        last_write = time.time()
+        _trace_ctx.oid = order_id
+        if entry.get("op") == "send":
+            err = _send_or_edit_reply(cardinal, order_id, int(entry.get("stars") or 5), entry.get("text") or "")
+        else:
+            err = _delete_our_reply(cardinal, order_id)
+
+        with _outbox_lock:
+            current = _outbox_items().get(order_id)
+            superseded = not current or current.get("seq") != entry.get("seq")
+            if err is None:
+                if not superseded:
+                    _outbox_items().pop(order_id, None)
+                    _outbox_save()
+            elif not superseded:
+                current["attempts"] = int(current.get("attempts") or 0) + 1
+                if current["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                    _outbox_items().pop(order_id, None)
+                else:
+                    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (current["attempts"] - 1))
+                    current["next_at"] = time.time() + delay
+                _outbox_save()
+
+        if err is None:
+            try:
+                _outbox_commit(order_id, entry)
+            except Exception as e:
+                loge(f"_outbox_commit({order_id}) failed: {e}")
+            continue
+
+        if superseded:
+            continue
+        msg = str(err).lower()
+        if "429" in msg or "too many" in msg:
+            cooldown_until = time.time() + OUTBOX_RATE_LIMIT_COOLDOWN
+            logw(f"FunPay rate limit, пауза {OUTBOX_RATE_LIMIT_COOLDOWN:.0f}с", key="outbox_rate_limit")
+        action = "отправить/обновить" if entry.get("op") == "send" else "удалить"
+        if current["attempts"] == 1:
+            _notify(cardinal, f"⚠️ {NAME}: не смог {action} ответ для заказа #{order_id}: {err}. Повторю попытку.")
+        elif current["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            _notify(cardinal, f"❌ {NAME}: не смог {action} ответ для заказа #{order_id} после {OUTBOX_MAX_ATTEMPTS} попыток: {err}")
+
+def _ensure_outbox_worker(cardinal: "Cardinal"):
+    global _outbox_thread, _outbox_cardinal
+    with _outbox_lock:
+        _outbox_cardinal = cardinal
+        if _outbox_thread is not None and _outbox_thread.is_alive():
+            return
+        _outbox_thread = threading.Thread(target=_outbox_worker, name="gpt-feedback-outbox", daemon=True)
+        _outbox_thread.start()
+
+def _queue_delete(order_id: str, prev: Optional[dict]):
+    _gen_cancel(order_id)
+    if prev:
+        _outbox_put(order_id, {"op": "delete"})
+    else:
+        _outbox_drop(order_id)
+
+def _closing_line(rating: int, when: Optional[datetime] = None) -> str:
+    when = when or datetime.now()
+    return CLOSING_TEMPLATE.format(rating=rating, date=when.strftime("%d.%m.%Y"), time=when.strftime("%H:%M:%S"))
+
+def _strip_closing(text: str) -> str:
+    t = CLOSING_RE.sub("", (text or "").strip())
+    t = re.sub(r"[ \t]*\n[ \t]*", "\n", t)
+    return re.sub(r"\n{3,}", "\n\n", t).strip()
+
+_drafts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_drafts_lock = threading.Lock()
+_pregen_queue: "queue.Queue[str]" = queue.Queue(maxsize=PREGEN_QUEUE_SIZE)
+_pregen_thread: Optional[threading.Thread] = None
+_pregen_cardinal: Optional["Cardinal"] = None
+
+def _drafts_purge(now: float):
+    for oid in [k for k, v in _drafts.items() if now - v["created"] > _perf["pregen_ttl"]]:
+        _drafts.pop(oid, None)
+    while len(_drafts) > _perf["pregen_cache_size"]:
+        _drafts.popitem(last=False)
+
+def _drafts_clear():
+    with _drafts_lock:
+        _drafts.clear()
+
+def _store_draft(order_id: str, stars: int, body: str):
+    now = time.time()
+    with _drafts_lock:
+        entry = _drafts.get(order_id)
+        if entry is None:
+            entry = _drafts[order_id] = {"created": now, "replies": {}}
+        entry["replies"][int(stars)] = body
+        _drafts.move_to_end(order_id)
+        _drafts_purge(now)
+
+def _has_drafts(order_id: str) -> bool:
+    with _drafts_lock:
+        return order_id in _drafts
+
+def _pregen_useful(cfg: dict) -> bool:
+    return not (cfg.get("fields") or {}).get("text")
+
+def _take_draft(cfg: dict, order_id: str, stars: int, order) -> Optional[str]:
+    with _drafts_lock:
+        entry = _drafts.pop(order_id, None)
+    if not entry or time.time() - entry["created"] > _perf["pregen_ttl"]:
+        return None
+    body = entry["replies"].get(int(stars))
+    if not body:
+        return None
+    review_text = str(getattr(getattr(order, "review", None), "text", "") or "").strip()
+    if review_text and (cfg.get("fields") or {}).get("text"):
+        return None
+    return f"{body}\n\n{_closing_line(stars)}"
 
-def _send_or_edit_reply(cardinal: "Cardinal", order_id: str, stars: int, text: str):
+def _pregen_order(cardinal: "Cardinal", order_id: str):
+    cfg = _get_config(load_data())
+    if not cfg.get("enabled") or not cfg.get("pregen") or not _pregen_useful(cfg) or _has_drafts(order_id):
+        return
+    api_key = _get_api_key(cfg)
+    if not api_key:
+        return
+
+    _trace_ctx.oid = order_id
     try:
-        cardinal.account.send_review(order_id=order_id, rating=int(stars), text=_cut_700_no_dots(text, MAX_CHARACTERS))
-        logi(f"✅ send_review({order_id}) OK")
+        order = _get_order(cardinal, order_id)
     except Exception as e:
-        loge(f"send_review({order_id}) failed: {e}")
-        _notify(cardinal, f"❌ {NAME}: не смог отправить/обновить ответ для заказа #{order_id}: {e}")
+        loge(f"pregen get_order({order_id}) failed: {e}")
+        return
+    if not order or _review_exists(order):
+        return
+
+    for stars in cfg.get("stars", [5]) or [5]:
+        if not _wait_gen_idle(PREGEN_IDLE_WAIT) or order_id in _gen_pending:
+            logkv(logging.INFO, "pregen_skipped", key="pregen_busy", order_id=order_id, stage="pregen", reason="busy")
+            break
+        body = generate_response(build_prompt(cfg, order, stars=stars), api_key, cfg.get("model", DEFAULT_MODEL))
+        if body == FALLBACK_REPLY or body.startswith("❌"):
+            continue
+        _store_draft(order_id, stars, body)
+    if _has_drafts(order_id):
+        logi(f"🔮 pregen({order_id}) готово")
+
+def _pregen_worker():
+    while True:
+        order_id = _pregen_queue.get()
+        try:
+            _pregen_order(_pregen_cardinal, order_id)
+        except Exception as e:
+            loge(f"pregen({order_id}) crashed: {e}")
+
+def _ensure_pregen_worker(cardinal: "Cardinal"):
+    global _pregen_thread, _pregen_cardinal
+    _pregen_cardinal = cardinal
+    if _pregen_thread is not None and _pregen_thread.is_alive():
+        return
+    _pregen_thread = threading.Thread(target=_pregen_worker, name="gpt-feedback-pregen", daemon=True)
+    _pregen_thread.start()
+
+_gen_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+_gen_pending: Dict[str, str] = {}
+_gen_lock = threading.Lock()
+_gen_threads: list = []
+
+def _gen_is_pending(order_id: str, fp: str) -> bool:
+    with _gen_lock:
+        return _gen_pending.get(order_id) == fp
+
+def _gen_cancel(order_id: str):
+    with _gen_lock:
+        _gen_pending.pop(order_id, None)
+
+def _submit_generation(job: Dict[str, Any]):
+    with _gen_lock:
+        _gen_pending[job["order_id"]] = job["fp"]
+    _gen_queue.put(job)
+
+def _finish_generation(job: Dict[str, Any], text: str):
+    order_id = job["order_id"]
+    with _gen_lock:
+        if _gen_pending.get(order_id) != job["fp"]:
+            logkv(logging.INFO, "generation_superseded", order_id=order_id, stage="generate")
+            return
+        _gen_pending.pop(order_id, None)
+    _outbox_put(order_id, {
+        "op": "send", "stars": job["stars"], "text": _cut_700_no_dots(text), "fp": job["fp"],
+        "model": job["model"], "latency_ms": round((time.perf_counter() - job["t0"]) * 1000), "vals": job["vals"],
+    })
+
+def _build_batch_prompt(jobs: list) -> str:
+    items = "\n\n".join(f"### Заказ {j['order_id']}\n{j['info_block']}" for j in jobs)
+    return BATCH_PROMPT_TEMPLATE.format(items=items)
+
+def _parse_batch_reply(content: str, order_ids: set) -> Dict[str, str]:
+    t = re.sub(r"^```(?:json)?|```$", "", (content or "").strip()).strip()
+    start, end = t.find("["), t.rfind("]")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        arr = json.loads(t[start:end + 1])
+    except Exception:
+        return {}
+    out = {}
+    for obj in arr if isinstance(arr, list) else []:
+        if not isinstance(obj, dict):
+            continue
+        oid = str(obj.get("order_id") or "").lstrip("#").strip()
+        reply = obj.get("reply")
+        if oid in order_ids and isinstance(reply, str) and oid not in out:
+            out[oid] = reply
+    return out
+
+def _generate_single(job: Dict[str, Any]):
+    _trace_ctx.oid = job["order_id"]
+    _trace_ctx.batch = None
+    text = generate_response(job["prompt"], job["api_key"], job["model"], job["closing"])
+    _finish_generation(job, text)
+
+def _run_batch(jobs: list):
+    with _gen_lock:
+        jobs = [j for j in jobs if _gen_pending.get(j["order_id"]) == j["fp"]]
+    if len(jobs) <= 1:
+        for j in jobs:
+            _generate_single(j)
+        return
+
+    _trace_ctx.oid = None
+    _trace_ctx.batch = [j["order_id"] for j in jobs]
+    t0 = time.perf_counter()
+    try:
+        content = _chat_content(_build_batch_prompt(jobs), jobs[0]["api_key"], jobs[0]["model"])
+    finally:
+        _trace_ctx.batch = None
+    replies = _parse_batch_reply(content or "", {j["order_id"] for j in jobs})
+
+    failed = []
+    for j in jobs:
+        repaired = _repair_reply(replies.get(j["order_id"]), j["closing"])
+        if repaired is None:
+            failed.append(j)
+        else:
+            _finish_generation(j, repaired)
+    logkv(logging.INFO, "batch_done", stage="generate", size=len(jobs), ok=len(jobs) - len(failed),
+          fallback=len(failed), duration_ms=round((time.perf_counter() - t0) * 1000))
+    for j in failed:
+        _generate_single(j)
+
+def _gen_excess() -> bool:
+    with _gen_lock:
+        me = threading.current_thread()
+        alive = [t for t in _gen_threads if t.is_alive()]
+        if len(alive) > _perf["gen_workers"] and me in alive:
+            _gen_threads.remove(me)
+            return True
+        return False
+
+def _gen_worker():
+    while True:
+        try:
+            first = _gen_queue.get(timeout=1.0)
+        except queue.Empty:
+            if _gen_excess():
+                return
+            continue
+        batch = [first]
+        deadline = time.monotonic() + _perf["batch_window_ms"] / 1000.0
+        while len(batch) < _perf["batch_max"]:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_gen_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        groups: Dict[tuple, list] = {}
+        for j in batch:
+            groups.setdefault((j["api_key"], j["model"]), []).append(j)
+        for jobs in groups.values():
+            try:
+                _run_batch(jobs)
+            except Exception as e:
+                loge(f"generation batch crashed: {e}", key="gen_batch_crash")
+                for j in jobs:
+                    _gen_cancel(j["order_id"])
+        if _gen_excess():
+            return
+
+def _ensure_gen_workers():
+    with _gen_lock:
+        _gen_threads[:] = [t for t in _gen_threads if t.is_alive()]
+        while len(_gen_threads) < max(1, _perf["gen_workers"]):
+            t = threading.Thread(target=_gen_worker, name=f"gpt-feedback-gen-{len(_gen_threads) + 1}", daemon=True)
+            t.start()
+            _gen_threads.append(t)
+
+_shadow_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+_shadow_lock = threading.Lock()
+_shadow_stats: Optional[Dict[str, Dict[str, Any]]] = None
+_shadow_thread: Optional[threading.Thread] = None
+
+def _parse_shadow_model(spec: str) -> tuple:
+    model, _, url = (spec or "").partition("@")
+    return model.strip(), url.strip() or None
+
+def _shadow_items() -> Dict[str, Dict[str, Any]]:
+    global _shadow_stats
+    if _shadow_stats is None:
+        _shadow_stats = {k: v for k, v in _load_json(SHADOW_FILE).items() if isinstance(v, dict)} \
+            if os.path.exists(SHADOW_FILE) else {}
+    return _shadow_stats
+
+def _shadow_record(label: str, result: Dict[str, Any], valid: bool):
+    usage = result.get("usage") or {}
+    with _shadow_lock:
+        st = _shadow_items().setdefault(label, {
+            "n": 0, "errors": 0, "valid": 0, "latencies": [], "prompt_tokens": 0, "completion_tokens": 0, "chars": 0,
+        })
+        st["n"] += 1
+        if result.get("content") is None:
+            st["errors"] += 1
+        else:
+            st["latencies"] = (st["latencies"] + [round(result["latency"], 3)])[-SHADOW_LATENCY_KEEP:]
+            st["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+            st["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+            st["chars"] += len(result["content"])
+            st["valid"] += 1 if valid else 0
+        _save_json(SHADOW_FILE, _shadow_items())
+
+def _shadow_reset():
+    global _shadow_stats
+    with _shadow_lock:
+        _shadow_stats = {}
+        _save_json(SHADOW_FILE, {})
+
+def _wait_gen_idle(limit: float) -> bool:
+    deadline = time.monotonic() + limit
+    while time.monotonic() < deadline:
+        with _gen_lock:
+            busy = bool(_gen_pending)
+        if not busy and _gen_queue.empty():
+            return True
+        time.sleep(0.5)
+    return False
+
+def _shadow_worker():
+    while True:
+        job = _shadow_queue.get()
+        for label, model, url in job["candidates"]:
+            if url and url != IO_CHAT_URL and not SHADOW_API_KEY_ENV:
+                _shadow_record(label, {"content": None, "usage": None, "latency": 0.0, "error": "no_shadow_key"}, False)
+                logw(f"shadow {label}: GPTFEEDBACK_SHADOW_API_KEY не задан, чужой URL пропущен", key="shadow_no_key")
+                continue
+            _wait_gen_idle(SHADOW_IDLE_WAIT)
+            api_key = SHADOW_API_KEY_ENV if url and url != IO_CHAT_URL else job["api_key"]
+            _trace_ctx.oid = job["order_id"]
+            _trace_ctx.shadow = label
+            try:
+                result = _chat_request(job["prompt"], api_key, model, url=url)
+            except Exception as e:
+                result = {"content": None, "usage": None, "latency": 0.0, "error": type(e).__name__}
+            finally:
+                _trace_ctx.shadow = None
+            valid = _repair_reply(result.get("content"), job["closing"]) is not None
+            _shadow_record(label, result, valid)
+            logkv(logging.INFO, "shadow_done", key="shadow_done", order_id=job["order_id"], model=label,
+                  latency_ms=round(result["latency"] * 1000), valid=valid, error=result.get("error"))
+
+def _maybe_shadow(cfg: dict, job: Dict[str, Any]):
+    global _shadow_thread
+    sh = cfg.get("shadow") or {}
+    if not sh.get("enabled") or not sh.get("models"):
+        return
+    try:
+        sample = float(sh.get("sample") or 0)
+    except (TypeError, ValueError):
+        return
+    if sample <= 0 or random.random() >= sample:
+        return
+
+    candidates = [(f"★ {job['model']}", job["model"], None)]
+    for spec in sh.get("models") or []:
+        model, url = _parse_shadow_model(spec)
+        if model and spec.strip() != job["model"]:
+            candidates.append((spec.strip(), model, url))
+
+    with _shadow_lock:
+        if _shadow_thread is None or not _shadow_thread.is_alive():
+            _shadow_thread = threading.Thread(target=_shadow_worker, name="gpt-feedback-shadow", daemon=True)
+            _shadow_thread.start()
+    try:
+        _shadow_queue.put_nowait({
+            "order_id": job["order_id"], "prompt": job["prompt"], "closing": job["closing"],
+            "api_key": job["api_key"], "candidates": candidates,
+        })
+    except queue.Full:
+        logw("shadow queue full, sample skipped", key="shadow_full")
+
+def _shadow_table() -> str:
+    with _shadow_lock:
+        items = {k: dict(v) for k, v in _shadow_items().items()}
+    if not items:
+        return "Данных пока нет."
+    rows = [f"{'модель':<20} {'n':>4} {'p50':>5} {'p95':>5} {'in':>5} {'out':>4} {'len':>4} {'ok%':>4} {'err':>3}"]
+    for label, st in sorted(items.items(), key=lambda kv: (not kv[0].startswith("★"), kv[0])):
+        ok = max(1, st["n"] - st["errors"])
+        lat = st.get("latencies") or []
+        rows.append(
+            f"{label[:20]:<20} {st['n']:>4} {_percentile(lat, 50):>5.2f} {_percentile(lat, 95):>5.2f} "
+            f"{st['prompt_tokens'] // ok:>5} {st['completion_tokens'] // ok:>4} {st['chars'] // ok:>4} "
+            f"{100 * st['valid'] // ok:>4} {st['errors']:>3}"
+        )
+    return "\n".join(rows)
+
+def _is_order_completed_type(msg_type) -> bool:
+    types = set()
+    for name in ("ORDER_CONFIRMED", "ORDER_CONFIRMED_BY_ADMIN"):
+        t = getattr(MessageTypes, name, None)
+        if t is not None:
+            types.add(t)
+    return msg_type in types
+
+def handle_order_completed(cardinal: "Cardinal", event: NewMessageEvent):
+    try:
+        if not _is_order_completed_type(getattr(event.message, "type", None)):
+            return
+
+        cfg = _get_config(load_data())
+        if not cfg.get("enabled") or not cfg.get("pregen") or not _pregen_useful(cfg):
+            return
+
+        order_id = _get_order_id_from_event(event)
+        if not order_id:
+            return
+
+        _set_trace(cfg.get("trace"), cfg)
+        _trace("ev", type=getattr(event.message.type, "name", str(event.message.type)), oid=order_id)
+        _ensure_pregen_worker(cardinal)
+        try:
+            _pregen_queue.put_nowait(order_id)
+        except queue.Full:
+            logw(f"pregen queue full, skip #{order_id}", key="pregen_full")
+    except Exception as e:
+        loge(f"handle_order_completed crashed: {e}", key="order_completed_crash")
 
 def handle_feedback_event(cardinal: "Cardinal", event: NewMessageEvent):
     try:
@@ -864,7 +2985,7 @@ def handle_feedback_event(cardinal: "Cardinal", event: NewMessageEvent):
 
         order_id = _get_order_id_from_event(event)
         if not order_id:
-            logw("Не нашёл order_id по regex #(...). Проверь формат event.message.")
+            logw("Не нашёл order_id по regex #(...). Проверь формат event.message.", key="no_order_id")
             return
 
         cfg = _get_config(load_data())
@@ -872,69 +2993,91 @@ def handle_feedback_event(cardinal: "Cardinal", event: NewMessageEvent):
         if not cfg.get("enabled"):
             return
 
+        _set_trace(cfg.get("trace"), cfg)
+        _trace_ctx.oid = order_id
+        _trace("ev", type=getattr(msg_type, "name", str(msg_type)), oid=order_id)
+
         api_key = _get_api_key(cfg)
         if not api_key:
             _notify(cardinal, f"❌ {NAME}: нет API ключа. Открой меню и задай ключ (или env IOINTELLIGENCE_API_KEY / IONET_API_KEY).")
             return
 
+        t_start = time.perf_counter()
         try:
-            order = cardinal.account.get_order(order_id)
+            order = _get_order(cardinal, order_id)
         except Exception as e:
-            loge(f"get_order({order_id}) failed: {e}")
+            logkv(logging.ERROR, "get_order_failed", key="get_order_failed", order_id=order_id, stage="fetch",
+                  error=str(e)[:200])
             return
+        t_fetch = time.perf_counter()
 
         if not order:
             return
 
+        _ensure_outbox_worker(cardinal)
         st = load_state()
         prev = st.get(order_id) if isinstance(st.get(order_id), dict) else None
         prev_fp = (prev or {}).get("review_fp")
+        pending = _outbox_get(order_id)
 
         if msg_type == getattr(MessageTypes, "FEEDBACK_DELETED", None):
-            if prev:
-                _delete_our_reply(cardinal, order_id)
-                st.pop(order_id, None)
-                save_state(st)
+            _queue_delete(order_id, prev)
             return
 
         if not _review_exists(order):
-            if prev:
-                _delete_our_reply(cardinal, order_id)
-                st.pop(order_id, None)
-                save_state(st)
+            _queue_delete(order_id, prev)
             return
 
         review = getattr(order, "review", None)
         stars = int(getattr(review, "stars", 5) or 5)
         fp = _buyer_review_fingerprint(order)
 
-        if prev_fp and prev_fp == fp:
+        if pending and pending.get("op") == "send" and pending.get("fp") == fp:
+            return
+        if _gen_is_pending(order_id, fp):
+            return
+        if prev_fp and prev_fp == fp and not pending:
             return
 
         allowed = cfg.get("stars", [5]) or [5]
         if stars not in allowed:
-            if prev:
-                _delete_our_reply(cardinal, order_id)
-                st.pop(order_id, None)
-                save_state(st)
+            _queue_delete(order_id, prev)
             return
 
-        prompt = build_prompt(cfg, order)
-        reply_text = generate_response(prompt, api_key, cfg.get("model", DEFAULT_MODEL))
-        reply_text = _cut_700_no_dots(reply_text, MAX_CHARACTERS)
-
-        _send_or_edit_reply(cardinal, order_id, stars, reply_text)
-
-        st[order_id] = {"review_fp": fp, "stars": stars, "updated_at": int(time.time())}
-        save_state(st)
+        model = cfg.get("model", DEFAULT_MODEL)
+        reply_text = _take_draft(cfg, order_id, stars, order) if cfg.get("pregen") else None
+        if reply_text is not None:
+            _gen_cancel(order_id)
+            _outbox_put(order_id, {
+                "op": "send", "stars": stars, "text": _cut_700_no_dots(reply_text), "fp": fp,
+                "model": f"{model} (draft)", "latency_ms": 0, "vals": _extract_order_fields(order),
+            })
+            source = "draft"
+        else:
+            vals = _extract_order_fields(order)
+            _ensure_gen_workers()
+            job = {
+                "order_id": order_id, "fp": fp, "stars": stars, "api_key": api_key, "model": model,
+                "prompt": build_prompt(cfg, order), "info_block": _build_info_block(cfg, order, vals),
+                "closing": _closing_line(stars), "vals": vals, "t0": t_fetch,
+            }
+            _submit_generation(job)
+            _maybe_shadow(cfg, job)
+            source = "llm"
+
+        logkv(logging.INFO, "feedback_queued", order_id=order_id, stage="queued", source=source, stars=stars,
+              fetch_ms=round((t_fetch - t_start) * 1000), duration_ms=round((time.perf_counter() - t_start) * 1000))
 
     except Exception as e:
-        loge(f"handle_feedback_event crashed: {e}")
+        loge(f"handle_feedback_event crashed: {e}", key="feedback_crash")
         _notify(cardinal, f"❌ {NAME} crashed: {e}")
 
 def init_cardinal(cardinal: "Cardinal"):
+    _setup_async_logging()
     tg = cardinal.telegram
     tg.msg_handler(lambda m: open_welcome(cardinal, m), commands=["gptfeedback_menu"])
+    tg.msg_handler(lambda m: _history_command(cardinal, m), commands=["gptfeedback_history"])
+    tg.msg_handler(lambda m: _profile_command(cardinal, m), commands=["gptfeedback_profile"])
     tg.msg_handler(lambda m: _handle_fsm(m, cardinal), func=lambda m: m.chat.id in _fsm)
     tg.cbq_handler(lambda c: open_welcome(cardinal, c), func=lambda c:
                    c.data.startswith(f"{CBT_EDIT_PLUGIN}:{UUID}")
@@ -945,10 +3088,19 @@ def init_cardinal(cardinal: "Cardinal"):
     tg.cbq_handler(lambda c: _delete_try(cardinal, c), func=lambda c: c.data == CB_DELETE_YES)
     tg.cbq_handler(lambda c: _delete_no(cardinal, c), func=lambda c: c.data == CB_DELETE_NO)
     tg.cbq_handler(lambda c: _toggle(cardinal, c), func=lambda c: c.data == CB_TOGGLE)
+    tg.cbq_handler(lambda c: _toggle_pregen(cardinal, c), func=lambda c: c.data == CB_PREGEN)
+    tg.cbq_handler(lambda c: _toggle_trace(cardinal, c), func=lambda c: c.data == CB_TRACE)
+    tg.cbq_handler(lambda c: _toggle_pool(cardinal, c), func=lambda c: c.data == CB_POOL)
     tg.cbq_handler(lambda c: _stars_open(cardinal, c), func=lambda c: c.data == CB_STARS)
     tg.cbq_handler(lambda c: _fields_open(cardinal, c), func=lambda c: c.data == CB_FIELDS)
     tg.cbq_handler(lambda c: _apikey_start(cardinal, c), func=lambda c: c.data == CB_APIKEY)
-    tg.cbq_handler(lambda c: _test_api(cardinal, c), func=lambda c: c.data == CB_TEST)
+    tg.cbq_handler(lambda c: _test_open(cardinal, c), func=lambda c: c.data == CB_TEST)
+    tg.cbq_handler(lambda c: _test_api(cardinal, c), func=lambda c: c.data == CB_TEST_ONE)
+    tg.cbq_handler(lambda c: _probe_run(cardinal, c), func=lambda c: c.data == CB_PROBE_RUN)
+    tg.cbq_handler(lambda c: _probe_set(cardinal, c, "n", int(c.data.split(":")[-1])),
+                   func=lambda c: c.data.startswith(f"{CB_PROBE_N}:"))
+    tg.cbq_handler(lambda c: _probe_set(cardinal, c, "concurrency", int(c.data.split(":")[-1])),
+                   func=lambda c: c.data.startswith(f"{CB_PROBE_C}:"))
     tg.cbq_handler(lambda c: open_welcome(cardinal, c), func=lambda c: c.data == CB_WELCOME)
     tg.cbq_handler(lambda c: open_settings(cardinal, c), func=lambda c: c.data == CB_SETTINGS)
     tg.cbq_handler(lambda c: _star_toggle(cardinal, c, int(c.data.split(":")[-1])),
@@ -956,17 +3108,264 @@ def init_cardinal(cardinal: "Cardinal"):
     tg.cbq_handler(lambda c: _field_toggle(cardinal, c, c.data.split(":")[-1]),
                    func=lambda c: c.data.startswith(f"{CB_FIELD_TOGGLE}:"))
     tg.cbq_handler(lambda c: _fsm_cancel(cardinal, c), func=lambda c: c.data == CB_CANCEL)
+    tg.cbq_handler(lambda c: _perf_open(cardinal, c), func=lambda c: c.data == CB_PERF)
+    tg.cbq_handler(lambda c: _shadow_open(cardinal, c), func=lambda c: c.data == CB_SHADOW)
+    tg.cbq_handler(lambda c: _shadow_toggle(cardinal, c), func=lambda c: c.data == CB_SHADOW_TOGGLE)
+    tg.cbq_handler(lambda c: _shadow_models_start(cardinal, c), func=lambda c: c.data == CB_SHADOW_MODELS)
+    tg.cbq_handler(lambda c: _shadow_stats_reset(cardinal, c), func=lambda c: c.data == CB_SHADOW_RESET)
+    tg.cbq_handler(lambda c: _shadow_set_sample(cardinal, c, int(c.data.split(":")[-1])),
+                   func=lambda c: c.data.startswith(f"{CB_SHADOW_SAMPLE}:"))
+    tg.cbq_handler(lambda c: _perf_reset(cardinal, c), func=lambda c: c.data == CB_PERF_RESET)
+    tg.cbq_handler(lambda c: _perf_edit_start(cardinal, c, int(c.data.split(":")[-1])),
+                   func=lambda c: c.data.startswith(f"{CB_PERF_EDIT}:"))
+    tg.cbq_handler(lambda c: _history_page(cardinal, c, None), func=lambda c: c.data == CB_HISTORY)
+    tg.cbq_handler(lambda c: _history_page(cardinal, c, int(c.data.split(":")[-1])),
+                   func=lambda c: c.data.startswith(f"{CB_HISTORY}:"))
     tg.cbq_handler(lambda c: _go_main_menu(cardinal, c), func=lambda c: c.data == CBT_BACK)
 
     try:
         cardinal.add_telegram_commands(UUID, [
             ("gptfeedback_menu", "Открыть меню GPT Feedback", True),
+            ("gptfeedback_history", "История ответов GPT Feedback (поиск)", True),
+            ("gptfeedback_profile", "Профилирование GPT Feedback: [сек] [mem] [topN]", True),
         ])
     except Exception as e:
         logw(f"add_telegram_commands failed: {e}")
 
+    _init_account(cardinal)
+    _load_runtime(cardinal)
     logi("✅ GPT Feedback запущен")
 
+def _load_runtime(cardinal: "Cardinal"):
+    cfg = _get_config(load_data())
+    _set_trace(cfg.get("trace"), cfg)
+    _apply_perf(cfg)
+    _set_pool(cfg.get("pool"))
+    _ensure_outbox_worker(cardinal)
+
+def post_init(cardinal: "Cardinal"):
+    if _init_account(cardinal):
+        _load_runtime(cardinal)
+
+def _percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    vs = sorted(values)
+    k = min(len(vs) - 1, max(0, int(round(p / 100.0 * (len(vs) - 1)))))
+    return vs[k]
+
+class _ReplayResponse:
+    def __init__(self, rec: dict):
+        self.status_code = int(rec.get("st") or 200)
+        self._body = rec.get("body")
+        self.text = self._body if isinstance(self._body, str) else json.dumps(self._body, ensure_ascii=False)
+
+    def json(self):
+        if isinstance(self._body, dict):
+            return self._body
+        return json.loads(self._body or "{}")
+
+class _ReplayMessage:
+    def __init__(self, msg_type, order_id: str):
+        self.type = msg_type
+        self._order_id = order_id
+
+    def __str__(self):
+        return f"Заказ #{self._order_id}"
+
+class _ReplayObj:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+def replay_trace(path: str, speed: float = 1.0) -> dict:
+    """Прогоняет записанную трассу через handle_feedback_event на локальных заглушках.
+
+    speed: 1 — реальное время, N — в N раз быстрее, 0 — без пауз.
+    p50/p95/max считаются от события до фиксации ответа в state (после записи на FunPay).
+    """
+    global DATA_FILE, STATE_FILE, OUTBOX_FILE, HISTORY_DB, RETRY_DELAY, _http_post, _outbox, _outbox_commit
+    global _history_ready, SHADOW_FILE, _shadow_stats
+    import tempfile
+
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    records.append(json.loads(line))
+                except Exception:
+                    pass
+
+    scale = (1.0 / speed) if speed and speed > 0 else 0.0
+    llm: Dict[str, list] = {}
+    llm_batch: list = []
+    orders: Dict[str, list] = {}
+    account_lat: Dict[str, list] = {}
+    cfg = _default_config()
+    first_cfg = next((r["cfg"] for r in records if r.get("k") == "cfg" and isinstance(r.get("cfg"), dict)), None)
+    if first_cfg:
+        cfg.update(first_cfg)
+    for r in records:
+        k, oid = r.get("k"), r.get("oid") or ""
+        if k == "llm":
+            llm.setdefault(oid, []).append(r)
+        elif k == "llm_batch":
+            llm_batch.append(r)
+        elif k == "order":
+            orders.setdefault(oid, []).append(r)
+        elif k in ("send", "delete"):
+            account_lat.setdefault(k, []).append(float(r.get("lat") or 0))
+    replay_over = {"enabled": True, "trace": False, "api_key": "replay", "shadow": {"enabled": False}}
+    cfg.update(replay_over)
+
+    def pop(bucket: Dict[str, list], oid: str) -> Optional[dict]:
+        q = bucket.get(oid) or []
+        if not q:
+            return None
+        return q.pop(0) if len(q) > 1 else q[0]
+
+    def pop_batch(oids: list) -> Optional[dict]:
+        want = set(oids)
+        for match in (lambda r: set(r.get("oids") or []) == want, lambda r: want & set(r.get("oids") or [])):
+            for i, r in enumerate(llm_batch):
+                if match(r):
+                    return llm_batch.pop(i)
+        return None
+
+    def stub_post(url, headers, payload, timeout):
+        batch = getattr(_trace_ctx, "batch", None)
+        rec = pop_batch(batch) if batch else pop(llm, getattr(_trace_ctx, "oid", None) or "")
+        if rec is None:
+            rec = {"st": 200, "lat": 0, "body": {"choices": [{"message": {"content": FALLBACK_REPLY * 3}}]}}
+        time.sleep(float(rec.get("lat") or 0) * scale)
+        if rec.get("err"):
+            raise requests.exceptions.RequestException(rec["err"])
+        return _ReplayResponse(rec)
+
+    def to_order(rec: Optional[dict]):
+        f = (rec or {}).get("f")
+        if not f:
+            return None
+        rv = f.get("review")
+        review = _ReplayObj(stars=rv.get("stars"), text=rv.get("text"), author=f.get("buyer")) if rv else None
+        return _ReplayObj(buyer_username=f.get("buyer"), title=f.get("item"), sum=f.get("cost"), review=review)
+
+    stats = {"events": 0, "sent": 0, "deleted": 0}
+
+    def acc_sleep(kind: str):
+        lats = account_lat.get(kind) or [0]
+        time.sleep(lats[(stats["sent"] + stats["deleted"]) % len(lats)] * scale)
+
+    def get_order(oid):
+        rec = pop(orders, oid)
+        time.sleep(float((rec or {}).get("lat") or 0) * scale)
+        return to_order(rec)
+
+    def send_review(order_id, rating, text):
+        acc_sleep("send")
+        stats["sent"] += 1
+
+    def delete_review(order_id):
+        acc_sleep("delete")
+        stats["deleted"] += 1
+
+    cardinal = _ReplayObj(
+        account=_ReplayObj(get_order=get_order, send_review=send_review, delete_review=delete_review),
+        telegram=_ReplayObj(bot=None, authorized_users=[]),
+    )
+
+    saved = (DATA_FILE, STATE_FILE, _http_post, _trace_enabled, OUTBOX_FILE, dict(_perf), _outbox, RETRY_DELAY,
+             _outbox_commit, HISTORY_DB, SHADOW_FILE, _shadow_stats)
+    tmp = tempfile.mkdtemp(prefix="gpt_feedback_replay_")
+    DATA_FILE, STATE_FILE = os.path.join(tmp, "data.json"), os.path.join(tmp, "state.json")
+    OUTBOX_FILE, _outbox = os.path.join(tmp, "outbox.json"), {}
+    with _history_lock:
+        HISTORY_DB, _history_ready = os.path.join(tmp, "history.db"), False
+    with _shadow_lock:
+        SHADOW_FILE, _shadow_stats = os.path.join(tmp, "shadow.json"), None
+    _apply_perf(cfg)
+    _perf["outbox_interval"] *= scale
+    RETRY_DELAY *= scale
+    _save_json(DATA_FILE, {"global": cfg})
+    _save_json(STATE_FILE, {})
+    _http_post = stub_post
+    _set_trace(False)
+
+    durations = []
+    started: Dict[str, float] = {}
+    commits = [0]
+    real_commit = saved[8]
+
+    def timed_commit(order_id: str, entry: Dict[str, Any]):
+        try:
+            real_commit(order_id, entry)
+            t_ev = started.pop(order_id, None)
+            if t_ev is not None:
+                durations.append(time.perf_counter() - t_ev)
+        finally:
+            commits[0] += 1
+
+    _outbox_commit = timed_commit
+    t_start = time.perf_counter()
+    prev_t = None
+    try:
+        for r in records:
+            if r.get("k") == "cfg" and isinstance(r.get("cfg"), dict) and r["cfg"] is not first_cfg:
+                cfg.update(r["cfg"])
+                cfg.update(replay_over)
+                _save_json(DATA_FILE, {"global": cfg})
+                _apply_perf(cfg)
+                _perf["outbox_interval"] *= scale
+                continue
+            if r.get("k") != "ev":
+                continue
+            msg_type = getattr(MessageTypes, str(r.get("type")), None)
+            if msg_type is None:
+                continue
+            if prev_t is not None and scale:
+                time.sleep(max(0.0, float(r["t"]) - prev_t) * scale)
+            prev_t = float(r["t"])
+            event = _ReplayObj(message=_ReplayMessage(msg_type, r.get("oid") or ""))
+            started[r.get("oid") or ""] = time.perf_counter()
+            for handler in BIND_TO_NEW_MESSAGE:
+                handler(cardinal, event)
+            stats["events"] += 1
+        deadline = time.time() + 600
+        while (_outbox_items() or _gen_pending or commits[0] < stats["sent"] + stats["deleted"]) \
+                and time.time() < deadline:
+            _outbox_wake.set()
+            time.sleep(0.05)
+    finally:
+        DATA_FILE, STATE_FILE, _http_post = saved[0], saved[1], saved[2]
+        OUTBOX_FILE, _outbox, RETRY_DELAY, _outbox_commit = saved[4], saved[6], saved[7], saved[8]
+        with _history_lock:
+            HISTORY_DB, _history_ready = saved[9], False
+        with _shadow_lock:
+            SHADOW_FILE, _shadow_stats = saved[10], saved[11]
+        _perf.update(saved[5])
+        _set_trace(saved[3])
+
+    stats.update({
+        "wall_s": round(time.perf_counter() - t_start, 3),
+        "committed": len(durations),
+        "p50_ms": round(_percentile(durations, 50) * 1000, 1),
+        "p95_ms": round(_percentile(durations, 95) * 1000, 1),
+        "max_ms": round(max(durations) * 1000, 1) if durations else 0.0,
+    })
+    return stats
+
 BIND_TO_PRE_INIT = [init_cardinal]
-BIND_TO_NEW_MESSAGE = [handle_feedback_event]
+BIND_TO_POST_INIT = [post_init]
+BIND_TO_NEW_MESSAGE = [handle_feedback_event, handle_order_completed]
 BIND_TO_DELETE = None
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=f"{NAME}: replay of a recorded feedback trace")
+    parser.add_argument("trace", nargs="?", default=TRACE_FILE)
+    parser.add_argument("--speed", default="1", help="1, N (в N раз быстрее) или max")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    print(json.dumps(replay_trace(args.trace, 0.0 if args.speed == "max" else float(args.speed)), ensure_ascii=False))